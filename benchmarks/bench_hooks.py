@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the git hooks on synthetic GRAND packages
+
+Copyright (C) 2018 The GRAND collaboration
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+# Benchmark the package manager of this source tree, not an installed one
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                "..")))
+
+from grand_pkg import PKG_FILE, RunContext, hooks
+from grand_pkg.cache import AnalysisCache, default_cache
+from grand_pkg.stats import dump_json
+try:
+    from grand_pkg.version import __version__, __git__
+except ImportError:
+    __version__ = None
+    __git__ = {}
+
+
+PACKAGE_NAME = "pkg"
+"""Name of the synthetic package"""
+
+METADATA = {"name": PACKAGE_NAME, "git-name": PACKAGE_NAME,
+            "dist-name": PACKAGE_NAME,
+            "description": "Synthetic package for benchmarks"}
+"""Metadata of the synthetic package"""
+
+
+def _make_docstring(summary, lines, indent, parameters=()):
+    """Render a numpy style docstring"""
+    body = [summary, ""]
+    body += ["Line {:} of the description of this object.".format(i)
+             for i in range(lines)]
+    if parameters:
+        body += ["", "Parameters", "----------"]
+        for name in parameters:
+            body += ["{:} : int".format(name),
+                     "    The {:} argument".format(name)]
+    body = [(indent + line) if line else "" for line in body]
+    body[0] = body[0].lstrip()
+    return '{:}"""{:}\n{:}"""\n'.format(indent, "\n".join(body), indent)
+
+
+def _make_module(index, functions, docstring):
+    """Render the source of a synthetic module
+
+    The module defines *functions* functions and as many classes. One
+    function out of two has an undocumented argument and a PEP8 violation.
+    """
+    names = ["f{:}".format(i) for i in range(functions)] +                  \
+            ["C{:}".format(i) for i in range(functions)]
+    source = [_make_docstring("Synthetic module {:}".format(index),
+                              docstring, ""),
+              "\n__all__ = [{:}]\n".format(
+                  ", ".join('"{:}"'.format(name) for name in names))]
+    for i in range(functions):
+        parameters = ("x", "y") if i % 2 else ("x", "y", "args")
+        source += [
+            "\n\ndef f{:}(x, y=1, *args, **kwargs):\n".format(i),
+            _make_docstring("Synthetic function {:}".format(i), docstring,
+                            "    ", parameters),
+            "    z = x + y\n",
+            "    for a in args:\n",
+            "        z{:}a\n".format("+=" if i % 2 else " += "),
+            "    return z\n"]
+    for i in range(functions):
+        source += [
+            "\n\nclass C{:}(object):\n".format(i),
+            _make_docstring("Synthetic class {:}".format(i), docstring,
+                            "    "),
+            "\n    def __init__(self, x):\n",
+            "        self.x = x\n",
+            "\n    def m(self, y):\n",
+            _make_docstring("Synthetic method", docstring, "        ",
+                            ("y",)),
+            "        return f{:}(self.x, y)\n".format(i)]
+    return "".join(source)
+
+
+def make_table(path, rows=100000):
+    """Generate a large module holding a table of *rows* rows
+
+    The module mimics the generated tables shipped by some packages.
+    """
+    with open(path, "w") as f:
+        f.write('"""Generated table"""\n\nTABLE = [\n')
+        for i in range(rows):
+            f.write("    ({:}, {:.17f}, {:.6f}, 'name_{:}'),\n".format(
+                i, (i * 0.618034) % 1, (i * 7.3891) % 1000, i))
+        f.write("]\n")
+
+
+def make_package(package_dir, modules=10, functions=10, docstring=5,
+                 depth=1):
+    """Generate a synthetic GRAND package, in a new git repository
+
+    The package is nested over *depth* levels of sub-packages, each one
+    holding *modules* modules. Each module defines *functions* functions and
+    as many classes, with docstrings of *docstring* description lines. The
+    initial content is committed.
+    """
+
+    path = os.path.join(package_dir, PACKAGE_NAME)
+    for level in range(depth):
+        os.makedirs(path)
+        sources = {"__init__.py": _make_docstring(
+            "Synthetic package of level {:}".format(level), docstring, "") +
+            "from .m0 import *\n"}
+        for i in range(modules):
+            sources["m{:}.py".format(i)] = _make_module(i, functions,
+                                                       docstring)
+        for basename, source in sources.items():
+            with open(os.path.join(path, basename), "w") as f:
+                f.write(source)
+        path = os.path.join(path, "sub{:}".format(level + 1))
+
+    # The generated files are committed as well, such that they can be reset
+    os.makedirs(os.path.join(package_dir, "docs"))
+    for basename in (os.path.join("docs", "README.md"), "README.md"):
+        with open(os.path.join(package_dir, basename), "w") as f:
+            f.write("# Synthetic package\n")
+    with open(os.path.join(package_dir, PKG_FILE), "w") as f:
+        dump_json({"package": METADATA}, f)
+
+    for args in (("init", "-q"), ("config", "user.name", "grand"),
+                 ("config", "user.email", "grand@example.com"),
+                 ("add", "."), ("commit", "-q", "-m", "Initial commit")):
+        hooks.git("-C", package_dir, *args)
+
+
+@contextlib.contextmanager
+def _settings(**kwargs):
+    """Run with the given `GRAND_PKG_` settings, only"""
+
+    environ = dict(os.environ)
+    try:
+        for k in [k for k in os.environ if k.startswith("GRAND_PKG_")]:
+            del os.environ[k]
+        for k, v in kwargs.items():
+            os.environ["GRAND_PKG_" + k] = v
+        yield
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+
+
+def _pre_commit(cache=None):
+    """Run the pre-commit hook in process, in the current directory"""
+    with RunContext("pre-commit") as context:
+        hooks.run_pre_commit(cache)
+    if context.code:
+        raise RuntimeError("pre-commit failed:\n" + context.out +
+                           context.err)
+
+
+def _reset(package_dir):
+    """Restore the committed state of the generated files"""
+    hooks.git("-C", package_dir, "reset", "-q", "--", PKG_FILE, "README.md")
+    hooks.git("-C", package_dir, "checkout", "-q", "--", PKG_FILE,
+              "README.md")
+
+
+def measure(function, repeat=5, setup=None):
+    """Time a function, in seconds, over several runs
+
+    The *setup* function, if any, is called before each run but is not
+    timed. Returns the fastest and the median runs, and all of them.
+    """
+    runs = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        function()
+        runs.append(round(time.perf_counter() - t0, 6))
+    return {"min": min(runs), "median": round(statistics.median(runs), 6),
+            "runs": runs}
+
+
+def run_benchmarks(package_dir, repeat=5, jobs=1, inform=None, table=None):
+    """Benchmark the analysers and the pre-commit hook on a package
+
+    The analysers and the full analysis run without any cache. The hook
+    runs in process from a full analysis without cache, from a warm cache
+    and incrementally, with a single staged module. The lines of a large
+    *table* module, if any, are counted as well. Returns the timings, by
+    benchmark.
+    """
+
+    path = os.path.join(package_dir, PACKAGE_NAME)
+    benchmarks = [
+        ("count_lines", lambda: hooks.count_lines(path)),
+        ("check_style", lambda: hooks.check_style(path)),
+        ("gather_doc", lambda: hooks.gather_doc(package_dir, PACKAGE_NAME)),
+        ("gather_stats",
+         lambda: hooks.gather_stats(package_dir, PACKAGE_NAME)),
+        ("analyse_package", lambda: hooks.analyse_package(
+            package_dir, {"package": dict(METADATA)},
+            jobs=jobs))]
+    if table is not None:
+        benchmarks.insert(1, ("count_lines/table",
+                              lambda: hooks.count_lines_in(table)))
+
+    results = {}
+    cwd = os.getcwd()
+    os.chdir(package_dir)
+    try:
+        with _settings(CACHE="0", STORE="0", JOBS=str(jobs)):
+            for name, function in benchmarks:
+                if inform:
+                    inform(name)
+                with RunContext(name):
+                    results[name] = measure(function, repeat)
+            _reset(package_dir)
+
+            if inform:
+                inform("pre-commit")
+            results["pre-commit"] = measure(_pre_commit, repeat,
+                                            lambda: _reset(package_dir))
+
+        # The default cache is disabled if the package manager version is
+        # unknown, e.g. when running from the sources
+        with _settings(STORE="0", JOBS=str(jobs)):
+            if inform:
+                inform("pre-commit/cached")
+            cache = default_cache(package_dir)
+            if cache is None:
+                cache = AnalysisCache(os.path.join(
+                    package_dir, ".git", "grand-pkg", "cache"), "benchmarks")
+            _pre_commit(cache)
+            results["pre-commit/cached"] = measure(
+                lambda: _pre_commit(cache), repeat,
+                lambda: _reset(package_dir))
+
+        # Commit the full statistics, then stage a modified module
+        hooks.git("commit", "-q", "-m", "Add the statistics")
+        with open(os.path.join(path, "m0.py"), "a") as f:
+            f.write('\n\ndef g(x):\n    """A staged function"""\n'
+                    "    return x\n")
+        hooks.git("add", os.path.join(PACKAGE_NAME, "m0.py"))
+
+        with _settings(CACHE="0", STORE="0", JOBS=str(jobs),
+                       INCREMENTAL="1"):
+            if inform:
+                inform("pre-commit/incremental")
+            results["pre-commit/incremental"] = measure(
+                _pre_commit, repeat, lambda: _reset(package_dir))
+    finally:
+        os.chdir(cwd)
+
+    return results
+
+
+def compare(results, baseline, statistic="min", tolerance=0.1):
+    """Compare benchmark results to a baseline
+
+    Returns the ratio of the *statistic* of each common benchmark to its
+    baseline value, and the names of the benchmarks that are slower than
+    the baseline by more than the relative *tolerance*.
+    """
+    ratios, regressions = {}, []
+    for name, result in sorted(results.items()):
+        try:
+            reference = baseline[name][statistic]
+        except KeyError:
+            continue
+        ratios[name] = result[statistic] / reference if reference else 1.
+        if ratios[name] > 1. + tolerance:
+            regressions.append(name)
+    return ratios, regressions
+
+
+def main(args=None):
+    """Benchmark the git hooks on a synthetic GRAND package"""
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark the git hooks on a synthetic GRAND package.')
+    parser.add_argument(
+        "-m", "--modules", dest = "modules", type = int, default = 10,
+        help = "the number of modules per package level")
+    parser.add_argument(
+        "-f", "--functions", dest = "functions", type = int, default = 10,
+        help = "the number of functions, and of classes, per module")
+    parser.add_argument(
+        "-d", "--docstring", dest = "docstring", type = int, default = 5,
+        help = "the number of description lines per docstring")
+    parser.add_argument(
+        "-n", "--depth", dest = "depth", type = int, default = 1,
+        help = "the number of nested package levels")
+    parser.add_argument(
+        "-l", "--table", dest = "table", type = int, default = 100000,
+        help = "the number of rows of a large generated table module")
+    parser.add_argument(
+        "-r", "--repeat", dest = "repeat", type = int, default = 5,
+        help = "the number of runs of each benchmark")
+    parser.add_argument(
+        "-j", "--jobs", dest = "jobs", type = int, default = 1,
+        help = "the number of analysis processes")
+    parser.add_argument(
+        "-o", "--output", dest = "output", type = str, default = None,
+        help = "the file where to save the results")
+    parser.add_argument(
+        "-c", "--compare", dest = "compare", type = str, default = None,
+        help = "a file of previous results, to compare with")
+    parser.add_argument(
+        "-t", "--tolerance", dest = "tolerance", type = float, default = 0.1,
+        help = "the relative slowdown tolerated when comparing")
+    args = parser.parse_args(args)
+
+    parameters = {"modules": args.modules, "functions": args.functions,
+                  "docstring": args.docstring, "depth": args.depth,
+                  "table": args.table, "repeat": args.repeat,
+                  "jobs": args.jobs}
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline["parameters"] != parameters:
+            print("Incompatible parameters: {:}".format(
+                json.dumps(baseline["parameters"], sort_keys=True)),
+                file=sys.stderr)
+            sys.exit(1)
+
+    def inform(name):
+        print("Running {:} ...".format(name), file=sys.stderr)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        package_dir = os.path.join(tmpdir, "package")
+        make_package(package_dir, args.modules, args.functions,
+                     args.docstring, args.depth)
+        table = os.path.join(tmpdir, "table.py")
+        make_table(table, args.table)
+        results = run_benchmarks(package_dir, args.repeat, args.jobs,
+                                 inform, table)
+
+    report = {"parameters": parameters, "results": results,
+              "python": platform.python_version(),
+              "platform": platform.platform(),
+              "manager": {"version": __version__, "git": __git__}}
+    if args.output is None:
+        dump_json(report, sys.stdout)
+    else:
+        with open(args.output, "w") as f:
+            dump_json(report, f)
+
+    if baseline is None:
+        sys.exit(0)
+
+    ratios, regressions = compare(results, baseline["results"],
+                                  tolerance=args.tolerance)
+    for name, ratio in ratios.items():
+        print("{:24} {:10.6f} {:10.6f} {:6.2f}{:}".format(
+            name, baseline["results"][name]["min"], results[name]["min"],
+            ratio, " (regression)" if name in regressions else ""),
+            file=sys.stderr)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -43,15 +43,34 @@ _check_version()
 PKG_FILE = ".grand-pkg.json"
 """File where GRAND package specific data are stored"""
 
+PKG_SHARDS = ".grand-pkg"
+"""Directory where the documentation shards are stored, if enabled"""
+
 PKG_PREFIX = "grand-pkg-"
 """Common prefix for GRAND package scripts"""
 
-__all__ = ["PKG_FILE", "PKG_PREFIX"]
+__all__ = ["PKG_FILE", "PKG_PREFIX", "PKG_SHARDS"]
 
 
-# Public exports
-from .setup import *
+# Public exports. Modules with heavy dependencies, e.g. setuptools, are only
+# loaded when their symbols are accessed
 from .test import *
-from .hooks import git
+
+_LAZY_EXPORTS = {"git": "hooks", "setup_package": "setup"}
+"""Lazily exported symbols, with their module"""
+
+
+def __getattr__(name):
+    try:
+        module = _LAZY_EXPORTS[name]
+    except KeyError:
+        raise AttributeError("module {!r} has no attribute {!r}".format(
+            __name__, name)) from None
+
+    import importlib
+    value = getattr(importlib.import_module("." + module, __name__), name)
+    globals()[name] = value
+    return value
+
 
 __all__ += ["__version__", "__git__", "git", "RunContext", "setup_package"]
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent cache for the analysis of package files
+
+Copyright (C) 2018 The GRAND collaboration
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>
+"""
+
+import collections
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from .session import get_git_dir
+
+try:
+    from .version import __version__, __git__
+except ImportError:
+    __version__ = None
+    __git__ = {}
+
+__all__ = ["AnalysisCache", "MemoryCache", "blob_sha", "default_cache"]
+
+_MAX_AGE = 30 * 24 * 3600
+"""Time after which unused cache directories are removed, in seconds"""
+
+
+def blob_sha(data):
+    """Compute the git blob SHA-1 of some raw content"""
+    header = "blob {:d}\0".format(len(data)).encode()
+    return hashlib.sha1(header + data).hexdigest()
+
+
+class AnalysisCache(object):
+    """Content addressed cache of analysis results
+
+    Results are stored as JSON files, one per blob and kind of analysis,
+    under a directory specific to the package manager version.
+    """
+
+    def __init__(self, path, version):
+        self.root = path
+        self.path = os.path.join(path, version)
+
+    def prune(self, max_age=_MAX_AGE):
+        """Remove the directories of other versions, unused for *max_age*
+
+        The directory of this version is marked as used. Directories are
+        removed by their modification time, such that the versions in use
+        by other environments sharing the cache are kept.
+        """
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            os.utime(self.path)
+            entries = list(os.scandir(self.root))
+        except OSError:
+            return
+
+        deadline = time.time() - max_age
+        for entry in entries:
+            try:
+                if (entry.path == self.path) or                              \
+                   (not entry.is_dir(follow_symlinks=False)) or             \
+                   (entry.stat().st_mtime > deadline):
+                    continue
+            except OSError:
+                continue
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+    def _get_path(self, sha, kind):
+        return os.path.join(self.path, sha[:2],
+                            "{:}.{:}.json".format(sha[2:], kind))
+
+    def get(self, sha, kind):
+        """Get a cached result, or `None` if it is not cached"""
+        try:
+            with open(self._get_path(sha, kind), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, sha, kind, value):
+        """Store a result in the cache"""
+        path = self._get_path(sha, kind)
+        dirname = os.path.dirname(path)
+        try:
+            os.makedirs(dirname, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=dirname, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(value, f)
+            os.replace(tmp, path)
+        except OSError:
+            # The cache is only an optimisation. Let us not fail on it
+            pass
+
+
+class MemoryCache(object):
+    """In memory cache of analysis results, in front of a *backend* if any
+
+    Results are kept serialised, such that each `get` returns a fresh copy
+    that the caller is free to modify. If a *max_size* is provided, in
+    bytes, the least recently used results are dropped beyond it.
+    """
+
+    def __init__(self, backend=None, max_size=None):
+        self.backend = backend
+        self.max_size = max_size
+        self._data = collections.OrderedDict()
+        self._size = 0
+
+    def _put(self, key, data):
+        """Keep serialised data, dropping the least recently used ones"""
+        previous = self._data.pop(key, None)
+        if previous is not None:
+            self._size -= len(previous)
+        self._data[key] = data
+        self._size += len(data)
+        if self.max_size is not None:
+            while self._size > self.max_size:
+                _, data = self._data.popitem(last=False)
+                self._size -= len(data)
+
+    def get(self, sha, kind):
+        """Get a cached result, or `None` if it is not cached"""
+        key = (sha, kind)
+        try:
+            data = self._data[key]
+        except KeyError:
+            pass
+        else:
+            self._data.move_to_end(key)
+            return json.loads(data)
+
+        if self.backend is None:
+            return None
+        value = self.backend.get(sha, kind)
+        if value is not None:
+            self._put(key, json.dumps(value))
+        return value
+
+    def set(self, sha, kind, value):
+        """Store a result in the cache"""
+        self._put((sha, kind), json.dumps(value))
+        if self.backend is not None:
+            self.backend.set(sha, kind, value)
+
+
+def default_cache(package_dir):
+    """Get the default analysis cache for a package
+
+    The cache is located under the git directory shared by all the worktrees
+    of the package, or under the user cache directory otherwise. Results are
+    specific to the package manager and to the Python versions. The
+    directories of other versions are removed once unused for a while.
+    `None` is returned if the cache is disabled, with `GRAND_PKG_CACHE=0`,
+    or if the package manager version is unknown.
+    """
+
+    if os.getenv("GRAND_PKG_CACHE", "1").lower() in ("", "0", "false", "no"):
+        return None
+
+    if __version__ is not None:
+        version = __version__
+    else:
+        try:
+            version = __git__["sha1"]
+        except KeyError:
+            return None
+
+    version += "-py{:}.{:}".format(*sys.version_info[:2])
+
+    path = get_git_dir(package_dir, common=True)
+    if path is not None:
+        path = os.path.join(path, "grand-pkg", "cache")
+    else:
+        path = os.getenv("XDG_CACHE_HOME",
+                         os.path.join(os.path.expanduser("~"), ".cache"))
+        path = os.path.join(path, "grand-pkg")
+
+    cache = AnalysisCache(path, version)
+    cache.prune()
+    return cache
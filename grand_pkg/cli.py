@@ -20,7 +20,6 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>
 
 import argparse
 import datetime
-import editor
 import json
 import os
 import re
@@ -28,10 +27,9 @@ import shutil
 import subprocess
 import sys
 
-from distutils.spawn import find_executable
-from setuptools import setup, find_packages
 from . import PKG_FILE, PKG_PREFIX
-from .hooks import get_top_directory
+from .hooks import get_top_directory, make_commit_msg_hook
+from .stats import dump_json
 
 try:
     input = input
@@ -360,7 +358,23 @@ if __name__ == "__main__":
 
 
 def _add_git_hook(git_dir, hook_name):
-    """Add a hook for managing git workflow"""
+    """Add a hook for managing git workflow
+
+    The prepare-commit-msg hook is a standalone script. Other hooks are
+    linked to their executable.
+    """
+    from distutils.spawn import find_executable
+
+    path = os.path.join(git_dir, "hooks", hook_name)
+    if hook_name == "prepare-commit-msg":
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        with open(path, "w") as f:
+            f.write(make_commit_msg_hook())
+        os.chmod(path, 0o755)
+        return True
 
     exe_name = PKG_PREFIX + hook_name
     exe_path = find_executable(exe_name)
@@ -371,7 +385,6 @@ def _add_git_hook(git_dir, hook_name):
         sys.stderr.write(os.linesep.join(msg))
         return False
 
-    path = os.path.join(git_dir, "hooks", hook_name)
     try:
         os.remove(path)
     except OSError:
@@ -490,6 +503,7 @@ def init(args=None):
     _mkdir(docs_dir)
 
     # Get the package name from any existing source
+    from setuptools import find_packages
     packages = find_packages(package_dir, exclude=("tests",))
     if len(packages) == 1:
         default_name = packages[0].lower()
@@ -580,7 +594,7 @@ def init(args=None):
     path = os.path.join(package_dir, PKG_FILE)
     if not os.path.exists(path):
         with open(path, "w") as f:
-            json.dump({"package": {"name": package_name, "git-name": git_name,
+            dump_json({"package": {"name": package_name, "git-name": git_name,
                                    "dist-name": dist_name,
                                    "description": description}}, f)
 
@@ -682,7 +696,7 @@ def update(args=None):
             system("git mv .stats.json " + PKG_FILE)
         path = os.path.join(package_dir, PKG_FILE)
         with open(path, "w") as f:
-            json.dump(stats, f)
+            dump_json(stats, f)
         system("git add " + PKG_FILE)
 
         # Update the setup file and the tests
@@ -766,6 +780,7 @@ def config(args=None):
                 sys.exit(1)
     else:
         # Spawn an editor
+        import editor
         txt = json.dumps(pkg_data["package"], sort_keys=True, indent=4)
         while True:
             txt = editor.edit(contents=txt.encode(), suffix=".json").decode()
@@ -799,7 +814,7 @@ def config(args=None):
 
     # Dump the updated data
     with open(path, "w") as f:
-        json.dump(pkg_data, f)
+        dump_json(pkg_data, f)
 
     system = _quiet_system if args.quiet else os.system
     system("git add " + PKG_FILE)
@@ -0,0 +1,505 @@
+# -*- coding: utf-8 -*-
+"""
+Optional daemon serving the git hooks of a package from memory
+
+Copyright (C) 2018 The GRAND collaboration
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>
+"""
+
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import select
+import socket
+import stat
+import struct
+import subprocess
+import sys
+import tempfile
+import traceback
+
+from . import PKG_FILE
+from .cache import MemoryCache, blob_sha, default_cache
+from .session import get_git_dir, run_git
+from .source import DiskTree, ScanTree
+from .test import RunContext
+try:
+    from .version import __version__
+except ImportError:
+    __version__ = None
+
+__all__ = ["Daemon", "daemon", "request", "socket_path"]
+
+
+_CACHE_SIZE = 64 * 2**20
+"""Maximum size of the in memory analysis results, in bytes"""
+
+
+def socket_path(package_dir, git_dir=None):
+    """Get the path to the daemon socket of a package
+
+    The socket is located under the package git directory, *git_dir*, which
+    is resolved if not provided. A temporary directory, specific to the user,
+    is used instead if this path is too long for a socket. In both cases, the
+    socket directory must be private, see `_is_private`.
+    """
+    if git_dir is None:
+        git_dir = get_git_dir(package_dir)
+    if git_dir is not None:
+        path = os.path.join(git_dir, "grand-pkg", "daemon", "daemon.sock")
+        if len(os.fsencode(path)) < 100:
+            return path
+
+    digest = hashlib.sha1(os.fsencode(package_dir)).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(),
+                        "grand-pkg-{:}".format(os.getuid()), digest + ".sock")
+
+
+def _is_private(path):
+    """Check that a directory is private to the current user
+
+    The directory must be owned by the user, with mode 0700, such that no
+    one else can plant a socket in it, e.g. under a shared temporary
+    directory.
+    """
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISDIR(st.st_mode) and (st.st_uid == os.getuid()) and      \
+           (stat.S_IMODE(st.st_mode) == 0o700)
+
+
+def _recv_all(sock):
+    """Receive data until the peer shuts down its side of the connection"""
+    chunks = []
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            return b"".join(chunks)
+        chunks.append(chunk)
+
+
+def _exchange(path, message, timeout=1.):
+    """Send a message to a daemon and return its reply, or `None`
+
+    Sockets in directories that are not private are not trusted.
+    """
+    if not (os.path.exists(path) and _is_private(os.path.dirname(path))):
+        return None
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(path)
+            sock.settimeout(None)
+            sock.sendall(json.dumps(message).encode() + b"\n")
+            sock.shutdown(socket.SHUT_WR)
+            reply = _recv_all(sock)
+    except OSError:
+        return None
+
+    try:
+        return json.loads(reply.decode())
+    except ValueError:
+        return None
+
+
+def request(command, *args):
+    """Run a hook command through the daemon of the current package
+
+    The output of the command is forwarded. Returns its exit code, or `None`
+    if no daemon could process the command.
+    """
+
+    try:
+        package_dir, git_dir = run_git("rev-parse", "--show-toplevel",
+                                       "--git-dir", check=True).split("\n")
+    except (subprocess.CalledProcessError, ValueError):
+        return None
+
+    env = {k: v for k, v in os.environ.items()
+           if k.startswith(("GIT_", "GRAND_PKG_"))}
+    path = socket_path(package_dir, os.path.abspath(git_dir))
+    reply = _exchange(path, {
+        "version": __version__, "command": command, "args": args,
+        "cwd": os.getcwd(), "env": env})
+    if (reply is None) or ("code" not in reply):
+        return None
+
+    sys.stdout.write(reply["out"])
+    sys.stderr.write(reply["err"])
+    return reply["code"]
+
+
+_IN_MODIFY = 0x2
+_IN_ATTRIB = 0x4
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_DELETE_SELF = 0x400
+_IN_MOVE_SELF = 0x800
+_IN_Q_OVERFLOW = 0x4000
+_IN_IGNORED = 0x8000
+_IN_ISDIR = 0x40000000
+
+
+class _Inotify(object):
+    """Watch of directories with inotify, through ctypes
+
+    Directories are watched one by one, not recursively. An `OSError` is
+    raised if inotify is not available.
+    """
+
+    _MASK = _IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM |    \
+            _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF |       \
+            _IN_MOVE_SELF
+    """Watched events"""
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            self._init = libc.inotify_init1
+            self._add_watch = libc.inotify_add_watch
+        except (OSError, AttributeError, TypeError) as e:
+            raise OSError("inotify is not available") from e
+
+        self.fd = self._init(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self._watches = {}
+        self._paths = {}
+
+    def add(self, path):
+        """Watch a directory, unless it is already watched"""
+        if path in self._paths:
+            return
+        wd = self._add_watch(self.fd, os.fsencode(path), self._MASK)
+        if wd >= 0:
+            self._watches[wd] = path
+            self._paths[path] = wd
+
+    def close(self):
+        """Stop watching"""
+        os.close(self.fd)
+
+    def read(self):
+        """Read the pending events
+
+        Returns the list of modified paths, or `None` if events were lost.
+        """
+
+        paths = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return paths
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, size = struct.unpack_from("iIII", data, offset)
+                offset += 16
+                name = data[offset:offset + size].rstrip(b"\0")
+                offset += size
+
+                if mask & _IN_Q_OVERFLOW:
+                    return None
+                try:
+                    root = self._watches[wd]
+                except KeyError:
+                    continue
+                if mask & _IN_IGNORED:
+                    del self._watches[wd]
+                    if self._paths.get(root, None) == wd:
+                        del self._paths[root]
+                    continue
+
+                path = os.path.join(root, os.fsdecode(name)) if name else root
+                paths.append(path)
+
+
+def _stat_key(path):
+    """Key identifying the state of a file on the disk"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+class _WatchedTree(DiskTree):
+    """Tree of files on the disk, memorising the SHA-1 of the files read
+
+    The *top* directory is indexed as a `ScanTree`, i.e. paths excluded by
+    `.gitignore` files up to *root* are skipped, as by the in process hook.
+    The SHA-1 of a file is kept until it changes, such that its analysis
+    results can be reused without reading it. Changes are notified by the
+    *watcher* if any, which watches the indexed directories. They are
+    detected from the file status otherwise. The index is refreshed on
+    changes.
+    """
+
+    def __init__(self, top, root=None, watcher=None):
+        self._top = os.path.normpath(top)
+        self._root = root
+        self._watcher = watcher
+        self._shas = {}
+
+        # The parent directories hold .gitignore files as well
+        self._parents = []
+        if root is not None:
+            path = os.path.normpath(root)
+            relpath = os.path.relpath(self._top, path)
+            if not relpath.startswith(os.pardir):
+                self._parents.append(path)
+                for name in relpath.split(os.sep)[:-1]:
+                    path = os.path.join(path, name)
+                    self._parents.append(path)
+        self._scan()
+
+    def _scan(self):
+        """Index the tree, and watch its directories"""
+        self._index = ScanTree(self._top, self._root)
+        if self._watcher is not None:
+            for path in self._parents:
+                self._watcher.add(path)
+            for path, _, _ in self._index.walk(self._top):
+                self._watcher.add(path)
+
+    def walk(self, top):
+        return self._index.walk(top)
+
+    def isdir(self, path):
+        return self._index.isdir(path)
+
+    def isfile(self, path):
+        return self._index.isfile(path)
+
+    def listdir(self, path):
+        return self._index.listdir(path)
+
+    def get_sha(self, path):
+        try:
+            sha, key = self._shas[path]
+        except KeyError:
+            return None
+        if (self._watcher is None) and (_stat_key(path) != key):
+            del self._shas[path]
+            return None
+        return sha
+
+    def read(self, paths):
+        contents = []
+        for path in paths:
+            key = _stat_key(path)
+            with open(path, "rb") as f:
+                data = f.read()
+
+            # The SHA-1 is only kept if the file did not change while read
+            if _stat_key(path) == key:
+                self._shas[path] = (blob_sha(data), key)
+            else:
+                self._shas.pop(path, None)
+            contents.append(data)
+        return contents
+
+    def update(self):
+        """Forget the SHA-1 of the files changed since the last update
+
+        The index is refreshed if any file changed, or at each update
+        without watcher.
+        """
+        if self._watcher is None:
+            self._scan()
+            return
+        paths = self._watcher.read()
+        if paths is None:
+            self._shas.clear()
+        elif not paths:
+            return
+        else:
+            for path in paths:
+                self._shas.pop(path, None)
+                prefix = path + os.sep
+                for k in [k for k in self._shas if k.startswith(prefix)]:
+                    del self._shas[k]
+        self._scan()
+
+
+@contextlib.contextmanager
+def _client_context(message):
+    """Run in the environment and in the directory of a client"""
+
+    environ, cwd = dict(os.environ), os.getcwd()
+    try:
+        for k in [k for k in os.environ if k.startswith(("GIT_",
+                                                         "GRAND_PKG_"))]:
+            del os.environ[k]
+        os.environ.update(message["env"])
+        os.chdir(message["cwd"])
+        yield
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+        os.chdir(cwd)
+
+
+class Daemon(object):
+    """Server processing the git hooks of a package from memory
+
+    Analysis results are kept in memory, by blob, up to `_CACHE_SIZE` bytes.
+    Files that did not change since the previous commit are neither read nor
+    analysed again. The
+    daemon stops after *timeout* seconds without requests, if provided.
+    """
+
+    def __init__(self, package_dir, timeout=None):
+        # The hooks module imports this one
+        from . import hooks
+
+        self.package_dir = package_dir
+        self.timeout = timeout
+        self.path = socket_path(package_dir)
+        self._hooks = hooks
+        self._cache = MemoryCache(default_cache(package_dir), _CACHE_SIZE)
+
+        with open(os.path.join(package_dir, PKG_FILE), "r") as f:
+            package_name = json.load(f)["package"]["name"]
+        try:
+            self._watcher = _Inotify()
+        except OSError:
+            self._watcher = None
+        self._tree = _WatchedTree(os.path.join(package_dir, package_name),
+                                  package_dir, self._watcher)
+        self._running = False
+
+    def _process(self, message):
+        """Process a request and return the reply"""
+
+        if message.get("version", None) != __version__:
+            return {"error": "Version mismatch"}
+
+        command = message["command"]
+        if command == "stop":
+            self._running = False
+            return {"code": 0, "out": "", "err": ""}
+        elif command == "pre-commit":
+            self._tree.update()
+            function = lambda: self._hooks.run_pre_commit(self._cache,
+                                                          self._tree)
+        elif command == "prepare-commit-msg":
+            function = self._hooks.run_prepare_commit_msg
+        else:
+            return {"error": "Unknown command `{}'".format(command)}
+
+        with _client_context(message), RunContext(
+            command, *message["args"]) as context:
+            function()
+        code = 0 if context.code is None else context.code
+        return {"code": code, "out": context.out, "err": context.err}
+
+    def serve(self):
+        """Serve requests until stopped"""
+
+        # The mode does not apply to an existing directory. It is checked
+        # instead
+        dirname = os.path.dirname(self.path)
+        os.makedirs(dirname, mode=0o700, exist_ok=True)
+        if not _is_private(dirname):
+            raise RuntimeError("The socket directory, {:}, is not private "
+                               "(owner and mode 0700)".format(dirname))
+        if _exchange(self.path, {"command": "ping"}) is not None:
+            raise RuntimeError("A daemon is already running")
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.path)
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            server.bind(self.path)
+            os.chmod(self.path, 0o600)
+            server.listen()
+            self._running = True
+            while self._running:
+                ready, _, _ = select.select([server], [], [], self.timeout)
+                if not ready:
+                    break
+                connection, _ = server.accept()
+                with connection:
+                    try:
+                        message = json.loads(_recv_all(connection).decode())
+                        reply = self._process(message)
+                    except Exception:
+                        reply = {"error": traceback.format_exc()}
+                    with contextlib.suppress(OSError):
+                        connection.sendall(json.dumps(reply).encode())
+        finally:
+            server.close()
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.path)
+            if self._watcher is not None:
+                self._watcher.close()
+
+
+def daemon(args=None):
+    """Run the daemon of a GRAND package"""
+
+    parser = argparse.ArgumentParser(
+        description='Serve the git hooks of a GRAND package from memory.')
+    parser.add_argument(
+        "path", type = str, nargs = "?", default = ".",
+        help = "the path to the package")
+    parser.add_argument(
+        "-s", "--stop", dest = "stop", action = "store_const",
+        const = True, default = False, help = "stop a running daemon")
+    parser.add_argument(
+        "-t", "--timeout", dest = "timeout", type = float, default = None,
+        help = "stop after some idle time, in seconds")
+    args = parser.parse_args(args)
+
+    try:
+        package_dir = run_git("rev-parse", "--show-toplevel",
+                              cwd=args.path, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        print("Not a GRAND package ...", file=sys.stderr)
+        sys.exit(1)
+
+    if args.stop:
+        reply = _exchange(socket_path(package_dir), {
+            "version": __version__, "command": "stop"})
+        sys.exit(0 if reply is not None else 1)
+
+    try:
+        server = Daemon(package_dir, args.timeout)
+    except (OSError, ValueError, KeyError):
+        print("Not a GRAND package ...", file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        server.serve()
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+    sys.exit(0)
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Statistics of a package over its git history
+
+Copyright (C) 2018 The GRAND collaboration
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from . import PKG_FILE
+from .cache import MemoryCache, default_cache
+from .hooks import gather_stats, get_top_directory
+from .session import GitSession, run_git
+from .source import GitTree
+from .store import default_store, summarise
+
+__all__ = ["analyse_commits", "history", "list_commits"]
+
+
+def list_commits(package_dir, *revisions):
+    """List the commits of some revisions, from the oldest to the newest
+
+    Returns a list of `(sha, time)` tuples, with the commit time as a Unix
+    timestamp.
+    """
+    output = run_git("log", "--reverse", "--format=%H %ct", *revisions, "--",
+                     cwd=package_dir, check=True)
+    commits = []
+    for line in output.splitlines():
+        sha, time = line.split()
+        commits.append((sha, int(time)))
+    return commits
+
+
+def _list_commit_keys(package_dir, *revisions):
+    """List the `(sha, parent, tree)` keys of the commits of some revisions
+
+    The parent is the first one, or `None` for a root commit.
+    """
+    output = run_git("log", "--format=%H %T %P", *revisions, "--",
+                     cwd=package_dir, check=True)
+    keys = []
+    for line in output.splitlines():
+        sha, tree, *parents = line.split()
+        keys.append((sha, (parents or [None])[0], tree))
+    return keys
+
+
+_memo = None
+"""Per process memo of analysis results, shared by all commits"""
+
+
+def _init_memo(cache):
+    """Initialise the memo of the current process"""
+    global _memo
+    _memo = MemoryCache(cache)
+
+
+def analyse_commits(package_dir, package_name, commits):
+    """Analyse a package at some commits, without checking them out
+
+    Returns the summary of each commit. Files are read straight from the
+    object database and blobs already analysed, e.g. by a previous commit,
+    are not read again.
+    """
+
+    if _memo is None:
+        _init_memo(None)
+
+    summaries = []
+    path = os.path.join(package_dir, package_name)
+    with GitSession(package_dir) as session:
+        for sha, time in commits:
+            summary = {"commit": sha, "time": time}
+            tree = GitTree.from_commit(session, package_dir, sha,
+                                       package_name)
+            if not tree.isdir(path):
+                summary["error"] = "Missing package `{}'".format(package_name)
+            else:
+                try:
+                    stats = gather_stats(package_dir, package_name, _memo,
+                                         tree=tree)
+                except Exception as e:
+                    # Past commits might hold broken sources
+                    summary["error"] = "{}: {}".format(type(e).__name__, e)
+                else:
+                    summary.update(summarise(stats))
+            summaries.append(summary)
+    return summaries
+
+
+def history(args=None):
+    """Compute the statistics of a GRAND package over its git history"""
+
+    parser = argparse.ArgumentParser(
+        description='Compute the statistics of a GRAND package over its git '
+                    'history, as JSON lines.')
+    parser.add_argument(
+        "revisions", type = str, nargs = "*", default = ["HEAD"],
+        help = "the revisions to analyse, as for git log")
+    parser.add_argument(
+        "-j", "--jobs", dest = "jobs", type = int, default = 1,
+        help = "the number of worker processes, or 0 for one per CPU")
+    parser.add_argument(
+        "-n", "--name", dest = "name", type = str, default = None,
+        help = "the package name, if not the current one")
+    parser.add_argument(
+        "-o", "--output", dest = "output", type = str, default = None,
+        help = "the output file, instead of the standard output")
+    parser.add_argument(
+        "-s", "--store", dest = "store", action = "store_const",
+        const = True, default = False,
+        help = "append the commits not yet recorded to the statistics store")
+    args = parser.parse_args(args)
+
+    package_dir = get_top_directory()
+    package_name = args.name
+    if package_name is None:
+        try:
+            with open(os.path.join(package_dir, PKG_FILE), "r") as f:
+                package_name = json.load(f)["package"]["name"]
+        except (OSError, ValueError, KeyError):
+            print("Not a GRAND package ...", file=sys.stderr)
+            sys.exit(1)
+
+    try:
+        commits = list_commits(package_dir, *args.revisions)
+    except subprocess.CalledProcessError as e:
+        print(e.output, file=sys.stderr)
+        sys.exit(1)
+
+    if args.store:
+        store = default_store(package_dir)
+        if store is None:
+            print("The statistics store is disabled ...", file=sys.stderr)
+            sys.exit(1)
+        # Commits recorded by the pre-commit hook are not analysed again
+        store.bind_commits(_list_commit_keys(package_dir, *args.revisions))
+        commits = [c for c in commits if not store.has_commit(c[0])]
+    else:
+        store = None
+
+    # Analyse chunks of neighbouring commits, such that most of their blobs
+    # are shared within a worker
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    size = max(1, min(64, len(commits) // (4 * jobs)))
+    chunks = [commits[i:i + size] for i in range(0, len(commits), size)]
+
+    cache = default_cache(package_dir)
+    if (jobs > 1) and (len(chunks) > 1):
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=jobs,
+                                       initializer=_init_memo,
+                                       initargs=(cache,))
+        results = executor.map(analyse_commits, len(chunks) * [package_dir],
+                               len(chunks) * [package_name], chunks)
+    else:
+        executor = None
+        _init_memo(cache)
+        results = (analyse_commits(package_dir, package_name, chunk)
+                   for chunk in chunks)
+
+    f = sys.stdout if args.output is None else open(args.output, "w")
+    try:
+        for summaries in results:
+            for summary in summaries:
+                f.write(json.dumps(summary) + os.linesep)
+            f.flush()
+            if store is not None:
+                store.append((s for s in summaries if "error" not in s),
+                             origin="history")
+    finally:
+        if f is not sys.stdout:
+            f.close()
+        if executor is not None:
+            executor.shutdown()
+        if store is not None:
+            store.close()
+
+    sys.exit(0)
@@ -19,25 +19,24 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>
 """
 
 import ast
-import glob
-import json
+import contextlib
+import filecmp
+import functools
+import io
+import math
 import os
 import re
 import subprocess
 import sys
-
-try:
-    import astor
-except ImportError:
-    astor = None
-
-try:
-    from pycodestyle import StyleGuide
-except ImportError:
-    StyleGuide = None
-
-from . import PKG_FILE
-from .setup import system
+import tempfile
+import time
+import tokenize
+
+from . import PKG_FILE, PKG_SHARDS, daemon, profiler
+from .cache import default_cache
+from .source import DiskTree, GitTree, ScanTree, load_source
+from .session import GitSession, run_git
+from .stats import dump_json, load_stats, split_doc
 try:
     from .version import __version__, __git__
 except ImportError:
@@ -48,10 +47,28 @@ except ImportError:
 __all__ = ["pre_commit", "prepare_commit_msg"]
 
 
+def _getenv_flag(name):
+    """Get a boolean flag from the environment"""
+    return os.getenv(name, "").lower() not in ("", "0", "false", "no")
+
+
+def _getenv_jobs():
+    """Get the number of analysis jobs from the environment
+
+    `GRAND_PKG_JOBS=0` selects one job per CPU.
+    """
+    try:
+        jobs = int(os.getenv("GRAND_PKG_JOBS", "1"))
+    except ValueError:
+        return 1
+    if jobs <= 0:
+        jobs = os.cpu_count() or 1
+    return jobs
+
+
 def git(*args):
     """System git call"""
-    command = "git " + " ".join(args)
-    return system(command)
+    return run_git(*args)
 
 
 def get_top_directory():
@@ -60,29 +77,57 @@ def get_top_directory():
     return top.strip()
 
 
-def count_lines_in(file_):
-    """Count the number of code lines in a Python file"""
+def get_staged_changes(package_name, session=None):
+    """Get the staged changes of a package, relative to HEAD
 
-    with open(file_, "r") as f:
-        lines = f.readlines()
+    Returns a list of `(status, path)` tuples, or `None` if there is no HEAD
+    to compare to.
+    """
+
+    if session is None:
+        session = GitSession()
+
+    try:
+        output = session.run("diff", "--cached", "--name-status",
+                             "--no-renames", "HEAD", "--", package_name)
+    except subprocess.CalledProcessError:
+        return None
+
+    changes = []
+    for line in output.splitlines():
+        try:
+            status, path = line.split("\t", 1)
+        except ValueError:
+            continue
+        changes.append((status[0], path))
+    return changes
+
+
+def _count_lines(lines, linesep=os.linesep, comment="#",
+                 quotes=('"""', "'''")):
+    """Classify lines as blank, comment, docstring or code
+
+    The *lines* can be any iterable, e.g. a stream, of strings or of bytes.
+    In the latter case the markers must be provided as bytes as well.
+    """
 
     docmarker = None
-    blank, comment, docstring, code = 4 * (0,)
+    blank, comment_, docstring, code = 4 * (0,)
     for line in lines:
         if docmarker is None:
-            if (not line) or (line == os.linesep):
+            if (not line) or (line == linesep):
                 blank += 1
-            elif line[0] == "#":
-                comment += 1
+            elif line.startswith(comment):
+                comment_ += 1
             else:
-                index = line.find('"""')
+                index = line.find(quotes[0])
                 if index >= 0:
-                    docmarker = '"""'
+                    docmarker = quotes[0]
                     docstring += 1
                 else:
-                    index = line.find("'''")
+                    index = line.find(quotes[1])
                     if index >= 0:
-                        docmarker = "'''"
+                        docmarker = quotes[1]
                         docstring += 1
                 if index == -1:
                     # This isn't a docstring neither, so it must be
@@ -98,45 +143,978 @@ def count_lines_in(file_):
             if docmarker in line:
                 docmarker = None
 
-    return blank, comment, docstring, code 
+    return blank, comment_, docstring, code
+
+
+_RAW_ENCODINGS = ("ascii", "iso-8859-1", "utf-8", "utf-8-sig")
+"""Encodings for which lines can be classified from their raw bytes"""
+
+
+def _universal_lines(readline):
+    """Stream raw lines, with universal newlines translated to `\\n`"""
+    for line in iter(readline, b""):
+        if b"\r" in line:
+            for piece in line.splitlines(True):
+                if piece.endswith((b"\r", b"\n")):
+                    piece = piece.rstrip(b"\r\n") + b"\n"
+                yield piece
+        else:
+            yield line
+
+
+def _count_raw_lines(stream):
+    """Count the code lines of a raw stream, without decoding it
+
+    The *stream* must provide `readline` and `seek`, e.g. a bytes buffer.
+    Lines are processed one at a time. `None` is returned if the source
+    encoding is not ASCII compatible.
+    """
+
+    try:
+        encoding, _ = tokenize.detect_encoding(stream.readline)
+    except SyntaxError:
+        encoding = "utf-8"
+    if encoding not in _RAW_ENCODINGS:
+        return None
+
+    # Skip the byte order mark, if any
+    stream.seek(3 if encoding == "utf-8-sig" else 0)
+    return _count_lines(_universal_lines(stream.readline),
+                        os.linesep.encode(), b"#", (b'"""', b"'''"))
+
+
+_NON_CODE_TOKENS = frozenset((tokenize.COMMENT, tokenize.DEDENT,
+                              tokenize.ENCODING, tokenize.ENDMARKER,
+                              tokenize.INDENT, tokenize.NEWLINE, tokenize.NL))
+"""Types of the tokens that are not code"""
+
+
+class _LineRanks(object):
+    """Ranks of the lines of a source, filled in a single pass
+
+    Rows are ranked as blank (0), comment (1), docstring (2) or code (3),
+    from the spans of the tokens met, in order. A row spanned by code is a
+    code row, whatever its other tokens. A logical line made of strings only
+    is a docstring. The rows of the strings of the pending logical line are
+    kept, until it is known to hold code or not.
+    """
+
+    __slots__ = ("counts", "row", "rank", "pending", "code")
+
+    def __init__(self):
+        self.counts = [0, 0, 0, 0]
+        self.row, self.rank = 0, 0
+        self.pending, self.code = [], False
+
+    def mark(self, start, end, value):
+        """Rank the rows spanned by a token, completing the previous ones"""
+        counts = self.counts
+        if start > self.row:
+            counts[self.rank] += 1
+            self.rank = 0
+        if end > start:
+            counts[max(self.rank, value)] += 1
+            counts[value] += end - start - 1
+            self.rank = value
+        elif value > self.rank:
+            self.rank = value
+        self.row = end
+
+    def flush(self, value):
+        """Rank the pending strings, and the comments following them"""
+        for start, end, rank in self.pending:
+            self.mark(start, end, value if rank is None else rank)
+        self.pending.clear()
+
+    def add_string(self, start, end):
+        """Rank a string, once its logical line is known"""
+        if self.code:
+            self.mark(start, end, 3)
+        else:
+            self.pending.append((start, end, None))
+
+    def add_comment(self, start, end):
+        """Rank a comment"""
+        if self.pending:
+            self.pending.append((start, end, 1))
+        else:
+            self.mark(start, end, 1)
+
+    def add_code(self, start, end):
+        """Rank a code token, and the pending strings of its logical line"""
+        if not self.code:
+            self.flush(3)
+            self.code = True
+        self.mark(start, end, 3)
+
+    def end_line(self):
+        """Complete a logical line"""
+        self.flush(2)
+        self.code = False
+
+    def get_counts(self, n_lines):
+        """Get the counts of blank, comment, docstring and code lines
+
+        The blank lines are the remaining ones, out of *n_lines*.
+        """
+        self.end_line()
+        counts = self.counts
+        counts[self.rank] += 1
+        counts[0] = n_lines - sum(counts[1:])
+        return tuple(counts)
+
+
+def _count_tokens(tokens, n_lines):
+    """Classify the lines of a token stream in a single pass
+
+    The total number of lines is given by *n_lines*, which is evaluated once
+    the stream is consumed.
+    """
+
+    ranks = _LineRanks()
+    for token in tokens:
+        type_ = token.type
+        if type_ == tokenize.STRING:
+            ranks.add_string(token.start[0], token.end[0])
+        elif type_ == tokenize.COMMENT:
+            ranks.add_comment(token.start[0], token.end[0])
+        elif type_ == tokenize.NEWLINE:
+            ranks.end_line()
+        elif type_ not in _NON_CODE_TOKENS:
+            ranks.add_code(token.start[0], token.end[0])
+    return ranks.get_counts(n_lines())
+
+
+_SCAN_SPECIAL = re.compile(r"[#'\"\\]")
+"""Characters starting a comment, a string or a line continuation"""
+
+_SCAN_ENDS = {
+    "'": re.compile(r"[^'\\]*(?:\\.[^'\\]*)*'"),
+    '"': re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"'),
+    "'''": re.compile(r"[^'\\]*(?:(?:\\.|'(?!''))[^'\\]*)*'''"),
+    '"""': re.compile(r'[^"\\]*(?:(?:\\.|"(?!""))[^"\\]*)*"""')}
+"""Patterns matching the end of strings, as used by tokenize"""
+
+_SCAN_CONTINUED = {
+    "'": re.compile(r"[^\n'\\]*(?:\\.[^\n'\\]*)*\\\r?\n"),
+    '"': re.compile(r'[^\n"\\]*(?:\\.[^\n"\\]*)*\\\r?\n')}
+"""Patterns matching single quoted strings continued on the next line"""
+
+_SCAN_PREFIXES = frozenset(("b", "r", "u", "f", "br", "rb", "fr", "rf"))
+"""Valid string prefixes, in lower case"""
+
+_SCAN_SIMPLE = re.compile(
+    r"[ \t\x0c]*(?:[^\s#'\"\\bBrRuUfF]|[bBrRuUfF]+(?=[^'\"bBrRuUfF]))"
+    r"[^#'\"\\\n]*(?:(?:'(?!'')[^'\\\n()\[\]{}]*'|"
+    r"\"(?!\"\")[^\"\\\n()\[\]{}]*\")[^#'\"\\\n]*)*\n?")
+"""Pattern matching rows starting with code, without any comment, line
+continuation, or string spanning rows or holding brackets"""
+
+_SCAN_UNSAFE = re.compile(r"[^\t\n\x0c\r -~]|[$?`]")
+"""Characters in code that the C tokenizer rejects, or might reject"""
+
+_SCAN_STRICT = hasattr(tokenize, "FSTRING_START")
+"""Flag for the C tokenizer, which is stricter and splits f-strings into
+code tokens"""
+
+_SCAN_BLANKS = " \t\x0c\r\n"
+"""Characters not producing any token"""
+
+
+def _scan_lines(lines):
+    """Classify lines as by the tokenizer, with a lightweight line scanner
+
+    Only comments, strings, brackets, line continuations and indentation are
+    looked for, with regular expressions, such that large generated modules
+    are classified in a fraction of the tokenizer time. `None` is returned
+    for sources holding constructs that the scanner does not settle, e.g.
+    tokenize errors. The token stream must be classified instead.
+    """
+
+    ranks = _LineRanks()
+    search = _SCAN_SPECIAL.search
+    simple = _SCAN_SIMPLE.fullmatch
+    unsafe = _SCAN_UNSAFE.search
+    depth, continued, indents = 0, False, [0]
+    string = None
+    row = 0
+    for row, line in enumerate(lines, 1):
+        pos = 0
+        if string is not None:
+            # Look for the end of a string spanning several rows
+            end, start, single = string
+            match = end.match(line)
+            if match is None:
+                if single and not line.endswith("\\\n"):
+                    return None
+                continue
+            ranks.add_string(start, row)
+            string = None
+            pos = match.end()
+        else:
+            if not (depth or continued):
+                # Check the indentation at the start of a logical line, as
+                # the tokenizer does
+                code = line.lstrip(" \t\x0c")
+                if code and (code[0] not in "#\r\n"):
+                    indent = line[:len(line) - len(code)]
+                    if indent.strip(" "):
+                        column = 0
+                        for c in indent:
+                            if c == " ":
+                                column += 1
+                            elif c == "\t":
+                                column = (column // 8 + 1) * 8
+                            else:
+                                column = 0
+                    else:
+                        column = len(indent)
+                    if column > indents[-1]:
+                        indents.append(column)
+                    while column < indents[-1]:
+                        indents.pop()
+                    if column != indents[-1]:
+                        return None
+
+            if simple(line) and not (_SCAN_STRICT and unsafe(line)):
+                # Fast path for rows of code, e.g. of generated tables
+                depth += line.count("(") + line.count("[") +              \
+                    line.count("{") - line.count(")") - line.count("]") -   \
+                    line.count("}")
+                if depth < 0:
+                    return None
+                ranks.add_code(row, row)
+                continued = False
+                if not depth:
+                    ranks.end_line()
+                continue
+
+        continued, has_code = False, False
+        while True:
+            match = search(line, pos)
+            index = len(line) if match is None else match.start()
+            segment = line[pos:index]
+            if match is not None:
+                c = line[index]
+                if (c in "'\"") and segment and (segment[-1] in "bBrRuUfF"):
+                    # Leave out the prefix of the string
+                    prefix = segment.rstrip("bBrRuUfF")
+                    n = len(segment) - len(prefix)
+                    if prefix and (prefix[-1].isalnum() or prefix[-1] == "_"):
+                        n = 0
+                    elif segment[-n:].lower() not in _SCAN_PREFIXES:
+                        n = 0
+                    elif _SCAN_STRICT and ("f" in segment[-n:].lower()):
+                        return None
+                    if n:
+                        segment = prefix
+            if segment.strip(_SCAN_BLANKS):
+                if _SCAN_STRICT and unsafe(segment):
+                    return None
+                depth += segment.count("(") + segment.count("[") +        \
+                    segment.count("{") - segment.count(")") -           \
+                    segment.count("]") - segment.count("}")
+                if depth < 0:
+                    return None
+                if not has_code:
+                    ranks.add_code(row, row)
+                    has_code = True
+            if match is None:
+                break
+
+            if c == "#":
+                ranks.add_comment(row, row)
+                break
+            elif c == "\\":
+                if line[index + 1:] not in ("\n", "\r\n"):
+                    return None
+                continued = True
+                break
+
+            # Skip a string, or open it for the next rows
+            if line.startswith(3 * c, index):
+                end = _SCAN_ENDS[3 * c]
+                match = end.match(line, index + 3)
+                single = False
+            else:
+                end = _SCAN_ENDS[c]
+                match = end.match(line, index + 1)
+                single = True
+            if match is None:
+                if single and not _SCAN_CONTINUED[c].match(line, index + 1):
+                    return None
+                string = (end, row, single)
+                break
+            pos = match.end()
+            if not has_code:
+                ranks.add_string(row, row)
+
+        if not (string or depth or continued):
+            ranks.end_line()
+
+    if string or depth or continued:
+        return None
+    return ranks.get_counts(row)
+
+
+def _count_rows(data):
+    """Count the lines of raw data, with universal newlines"""
+    n = data.count(b"\n") + data.count(b"\r") - data.count(b"\r\n")
+    if data and not data.endswith((b"\n", b"\r")):
+        n += 1
+    return n
+
+
+def count_lines_in(file_, lines=None):
+    """Count the number of code lines in a Python file
+
+    The file is streamed, as by the hooks analyser, unless its *lines* are
+    provided. Lines are classified by a line scanner, or from the token
+    stream if the scanner does not settle them. The raw lines are classified
+    instead if the file cannot be tokenized.
+    """
+
+    if lines is None:
+        return _count_source_lines(load_source(file_))
+
+    counts = _scan_lines(lines)
+    if counts is not None:
+        return counts
+
+    try:
+        return _count_tokens(tokenize.generate_tokens(iter(lines).__next__),
+                             lambda: len(lines))
+    except (SyntaxError, tokenize.TokenError):
+        return _count_lines(lines)
+
+
+def _count_source_lines(source):
+    """Count the code lines of a shared source, streaming its lines
+
+    The token stream is classified only if the line scanner gives up. The
+    tokens are streamed as well, unless the style checker already kept them.
+    """
+
+    counts = _scan_lines(source.iter_lines())
+    if counts is not None:
+        return counts
+
+    try:
+        return _count_tokens(source.iter_tokens(),
+                             lambda: _count_rows(source.data))
+    except (SyntaxError, tokenize.TokenError):
+        pass
+
+    counts = _count_raw_lines(io.BytesIO(source.data))
+    if counts is None:
+        counts = _count_lines(source.lines)
+    return counts
+
+
+def _map(function, args, executor=None):
+    """Map a function over a list of arguments, with an executor if any
+
+    The results are returned in the order of the arguments.
+    """
+
+    if (executor is None) or (len(args) < 2):
+        return [function(*a) for a in args]
+
+    chunksize = max(1, len(args) // (4 * (os.cpu_count() or 1)))
+    return list(executor.map(function, *zip(*args), chunksize=chunksize))
+
+
+def _cache_kind(kind):
+    """Get the cache key of a kind of analysis
+
+    PEP8 results also depend on the version of pycodestyle, and doc results
+    on the backend rendering prototypes.
+    """
+    if kind == "pep8":
+        return "pep8-" + _get_pycodestyle().__version__
+    elif kind in ("doc", "doc-init"):
+        return kind + ("-unparse" if _UNPARSE else "-astor")
+    return kind
+
+
+def _cached(cache, kind, analyse, source):
+    """Analyse a source, using a cache if any"""
+
+    if cache is None:
+        return analyse(source)
+
+    key = _cache_kind(kind)
+    result = cache.get(source.sha, key)
+    if result is None:
+        result = analyse(source)
+        cache.set(source.sha, key, result)
+    return result
+
+
+def _analyse_file(path, kinds, cache=None, data=None, sha=None,
+                  profile=False):
+    """Run a set of analysers on a file, loading it only once
+
+    The style checker runs first, since it keeps the tokens of the source
+    that the line counter then reuses. If *profile* is `True`, the records
+    of the loading and of each analyser are appended to the results, as a
+    dict.
+    """
+    order = sorted(kinds, key=lambda kind: kind != "pep8")
+    results = {}
+    if not profile:
+        source = load_source(path, data, sha)
+        for kind in order:
+            results[kind] = _cached(cache, kind, _ANALYSERS[kind], source)
+        return [results[kind] for kind in kinds]
+
+    recorder = profiler.start()
+    records = {}
+    with recorder.measure() as records["load"]:
+        source = load_source(path, data, sha)
+    for kind in order:
+        with recorder.measure() as records[kind]:
+            results[kind] = _cached(cache, kind, _ANALYSERS[kind], source)
+    return [results[kind] for kind in kinds] + [records]
+
+
+def _get_task_size(args):
+    """Get the size of the file analysed by a task, or 0 if unknown"""
+    path, data = args[0], args[3]
+    if data is not None:
+        return len(data)
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _init_worker(profile=False):
+    """Prepare an analysis worker process
+
+    The style guide is built once per worker, before any file is checked.
+    The worker is profiled if *profile* is `True`.
+    """
+    if profile:
+        profiler.start()
+    _get_style_guide()
+
+
+def _get_executor(jobs):
+    """Get a pool of *jobs* analysis processes, or `None` for a single job"""
+    if (jobs is None) or (jobs <= 1):
+        return None
 
+    from concurrent.futures import ProcessPoolExecutor
+    profile = profiler.get_profiler() is not None
+    return ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                               initargs=(profile,))
 
-def count_lines(path):
-    """Count the number of Python code lines, recursively"""
 
-    def format(counts):
-        return {"blank": counts[0], "comment": counts[1],
-                "docstring": counts[2], "code": counts[3]}
+def _analyse_files(tasks, cache=None, executor=None, results=None,
+                   tree=None):
+    """Run analysers on a set of files, loading each file only once
+
+    The *tasks* are `(path, kind)` tuples. Results already available in
+    *results*, indexed by task, are not computed again. New results are added
+    to it. The results are returned in the order of the tasks. Files are read
+    from the *tree* if any, or from the disk otherwise.
+    """
+
+    if results is None:
+        results = {}
+
+    pending = {}
+    for task in tasks:
+        if task not in results:
+            path, kind = task
+            kinds = pending.setdefault(path, [])
+            if kind not in kinds:
+                kinds.append(kind)
+
+    if tree is None:
+        args = [(path, kinds, cache, None, None)
+                for path, kinds in pending.items()]
+    else:
+        # Use the cached results of known blobs without reading them. The
+        # other files are read in bulk
+        args = []
+        for path, kinds in pending.items():
+            sha = tree.get_sha(path)
+            if (cache is not None) and (sha is not None):
+                values = [cache.get(sha, _cache_kind(kind))
+                          for kind in kinds]
+                if None not in values:
+                    for kind, value in zip(kinds, values):
+                        results[(path, kind)] = value
+                    continue
+            args.append((path, kinds, cache))
+
+        # The SHA-1 is queried again once read, since the file might have
+        # changed in between. It must refer to the content analysed, or the
+        # results would be cached under a wrong blob
+        contents = tree.read([a[0] for a in args])
+        args = [a + (data, None if data is None else tree.get_sha(a[0]))
+                for a, data in zip(args, contents)]
+
+    if executor is not None:
+        # Dispatch the largest files first, for a better load balance
+        args.sort(key=_get_task_size, reverse=True)
+
+    recorder = profiler.get_profiler()
+    if recorder is not None:
+        args = [a + (True,) for a in args]
+
+    for (path, kinds, *_), values in zip(args,
+                                         _map(_analyse_file, args, executor)):
+        if recorder is not None:
+            recorder.add_file(path, values.pop())
+        for kind, value in zip(kinds, values):
+            results[(path, kind)] = value
+
+    return [results[task] for task in tasks]
+
+
+def _list_sources(path, tree=None):
+    """List the Python source files, recursively"""
 
     _, ext = os.path.splitext(path)
     if ext == ".py":
-        return format(count_lines_in(path))
+        return [path]
 
-    counts = 4 * [0,]
-    for root, dirs, files in os.walk(path):
+    if tree is None:
+        tree = ScanTree(path)
+
+    paths = []
+    for root, dirs, files in tree.walk(path):
         for file_ in files:
             _, ext = os.path.splitext(file_)
             if ext == ".py":
-                c = count_lines_in(os.path.join(root, file_))
-                for i, ci in enumerate(c):
-                    counts[i] += ci
-    return format(counts)
+                paths.append(os.path.join(root, file_))
+    return paths
+
+
+_LINE_KEYS = ("blank", "comment", "docstring", "code")
+"""Categories of lines, in the order of the counts"""
+
+
+def _format_lines(counts, files):
+    """Format line counts, with the per file counts, *files*"""
+    lines = dict(zip(_LINE_KEYS, counts))
+    lines["files"] = {path: files[path] for path in sorted(files)}
+    return lines
+
 
+def count_lines(path, cache=None, executor=None, results=None, tree=None):
+    """Count the number of Python code lines, recursively
 
-def check_style(path):
-    """Check the conformity to PEP8"""
+    The lines are also counted per file, as `[blank, comment, docstring,
+    code]`, with paths relative to the parent of *path*.
+    """
 
-    if StyleGuide is not None:
-        style_guide = StyleGuide(quiet=True)
-        report = style_guide.check_files(paths=(path,))
-        stats = [line.split(None, 2) for line in report.get_statistics()]
-        return { "count": report.get_count(), "categories": stats }
+    paths = _list_sources(path, tree)
+    tasks = [(file_, "lines") for file_ in paths]
+    top = os.path.dirname(os.path.normpath(path)) or os.curdir
+    counts, files = 4 * [0,], {}
+    for file_, c in zip(paths, _analyse_files(tasks, cache, executor,
+                                              results, tree)):
+        for i, ci in enumerate(c):
+            counts[i] += ci
+        if any(c):
+            files[os.path.relpath(file_, top)] = list(c)
+    return _format_lines(counts, files)
+
+
+def _walk_style(style_guide, path, tree=None):
+    """Walk the files checked by pycodestyle, in the same order"""
+
+    if tree is None:
+        tree = ScanTree(path)
+
+    if not tree.isdir(path):
+        if not style_guide.excluded(path):
+            yield path
+        return
+    elif style_guide.excluded(path):
+        return
+
+    patterns = style_guide.options.filename
+    for root, dirs, files in tree.walk(path):
+        for subdir in sorted(dirs):
+            if style_guide.excluded(subdir, root):
+                dirs.remove(subdir)
+        for filename in sorted(files):
+            if _get_pycodestyle().filename_match(filename, patterns) and      \
+               not style_guide.excluded(filename, root):
+                yield os.path.join(root, filename)
+
+
+def _merge_style(categories, result, sign=1):
+    """Merge the PEP8 results of a file into aggregated categories"""
+    for code, (n, message) in result.items():
+        try:
+            category = categories[code]
+        except KeyError:
+            category = [0, message]
+            categories[code] = category
+        category[0] += sign * n
+
+
+def _count_style(result):
+    """Count the PEP8 errors of a file, by code"""
+    return {code: n for code, (n, _) in sorted(result.items()) if n > 0}
+
+
+def _format_style(categories, files):
+    """Format aggregated PEP8 categories as pycodestyle statistics
+
+    The per file error counts, *files*, are added as well.
+    """
+    categories = [[str(n), code, message] for code, (n, message)
+                  in sorted(categories.items()) if n > 0]
+    count = sum(int(category[0]) for category in categories)
+    files = {path: files[path] for path in sorted(files)}
+    return { "count": count, "categories": categories, "files": files }
+
+
+def check_style(path, cache=None, executor=None, results=None, tree=None):
+    """Check the conformity to PEP8
+
+    The errors are also counted per file, with paths relative to the parent
+    of *path*.
+    """
+
+    style_guide = _get_style_guide()
+    if style_guide is not None:
+        paths = list(_walk_style(style_guide, path, tree))
+        tasks = [(file_, "pep8") for file_ in paths]
+        top = os.path.dirname(os.path.normpath(path)) or os.curdir
+        categories, files = {}, {}
+        for file_, result in zip(paths, _analyse_files(tasks, cache, executor,
+                                                       results, tree)):
+            _merge_style(categories, result)
+            counts = _count_style(result)
+            if counts:
+                files[os.path.relpath(file_, top)] = counts
+        return _format_style(categories, files)
+    else:
+        return { "count": None, "categories": None, "files": None }
+
+
+@functools.lru_cache(maxsize=None)
+def _get_pycodestyle():
+    """Import pycodestyle on demand, or get `None` if it is not installed"""
+    try:
+        import pycodestyle
+    except ImportError:
+        return None
+    return pycodestyle
+
+
+@functools.lru_cache(maxsize=None)
+def _get_style_guide():
+    """Get a pycodestyle style guide, shared within the process
+
+    `None` is returned if pycodestyle is not installed.
+    """
+    pycodestyle = _get_pycodestyle()
+    if pycodestyle is None:
+        return None
+    return pycodestyle.StyleGuide(quiet=True)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_source_checker():
+    """Get the pycodestyle checker class for shared sources"""
+    from pycodestyle import Checker, noqa
+
+    class SourceChecker(Checker):
+        """pycodestyle checker running over the tokens of a shared source"""
+
+        def __init__(self, source, options):
+            Checker.__init__(self, source.path, lines=source.lines,
+                             options=options)
+            self._source = source
+
+        def check_ast(self):
+            try:
+                tree = self._source.tree
+            except (ValueError, SyntaxError, TypeError):
+                return self.report_invalid_syntax()
+            for name, cls, __ in self._ast_checks:
+                checker = cls(tree, self.filename)
+                for lineno, offset, text, check in checker.run():
+                    if not self.lines or not noqa(self.lines[lineno - 1]):
+                        self.report_error(lineno, offset, text, check)
+
+        def generate_tokens(self):
+            prev_physical = ""
+            for token in self._source.tokens:
+                if token[2][0] > self.total_lines:
+                    return
+                # Consume the lines read by the tokenizer, since the checker
+                # state is updated from there
+                while self.line_number < token[3][0]:
+                    if not self.readline():
+                        break
+                self.noqa = token[4] and noqa(token[4])
+                self.maybe_check_physical(token, prev_physical)
+                yield token
+                prev_physical = token[4]
+
+            error = self._source.token_error
+            if error is not None:
+                try:
+                    raise error
+                except (SyntaxError, tokenize.TokenError):
+                    self.report_invalid_syntax()
+
+    return SourceChecker
+
+
+def check_style_in(file_, source=None):
+    """Check the conformity of a single Python file to PEP8
+
+    Returns a dictionary mapping error codes to their count and message.
+    The tokens of the shared *source* are used if provided.
+    """
+
+    style_guide = _get_style_guide()
+    if style_guide is None:
+        return None
+
+    if source is None:
+        source = load_source(file_)
+
+    report = style_guide.init_report()
+    _get_source_checker()(source, style_guide.options).check_all()
+    return {code: [report.counters[code], message]
+            for code, message in report.messages.items()}
+
+
+def _get_doc(node):
+    """Get the docstring of a node"""
+    try:
+        doc = ast.get_docstring(node, clean=True)
+    except:
+        return ""
+    else:
+        if doc is None:
+            doc = ""
+        return doc
+
+
+def _get_docstr(nodes, index):
+    """Try to get a docstring at the given index"""
+    try:
+        n = nodes[index]
+    except IndexError:
+        pass
+    else:
+        if isinstance(n, ast.Expr) and isinstance(n.value, ast.Str):
+            return n.value.s
+    return ""
+
+
+def _render_all(nodes):
+    """Render a list of expressions, or get `None` if any is unusual"""
+    items = []
+    for node in nodes:
+        item = _render(node)
+        if item is None:
+            return None
+        items.append(item)
+    return items
+
+
+_UNPARSE = hasattr(ast, "unparse")
+"""Flag for rendering syntax trees with `ast.unparse`, or with astor before
+Python 3.9"""
+
+
+def _render(node):
+    """Render an usual expression as the backend does, or get `None`
+    otherwise"""
+
+    if isinstance(node, ast.Name):
+        return node.id
+    elif isinstance(node, ast.Attribute):
+        if isinstance(node.value, (ast.Name, ast.Attribute)):
+            value = _render(node.value)
+            if value is not None:
+                return value + "." + node.attr
+    elif isinstance(node, ast.Constant):
+        value = node.value
+        if getattr(node, "kind", None) is not None:
+            # This is an u-prefixed string
+            return None
+        elif (value is None) or isinstance(value, (bool, int, bytes)):
+            return repr(value)
+        elif isinstance(value, float):
+            if math.isfinite(value):
+                return repr(value)
+        elif isinstance(value, str):
+            # Long or multiline strings might be rendered with triple
+            # quotes, as well as strings with both kinds of quotes
+            text = repr(value)
+            if (len(text) < 20) and ("\n" not in value) and               \
+               (("'" not in value) or ('"' not in value)):
+                return text
+    elif isinstance(node, ast.UnaryOp):
+        if isinstance(node.op, ast.USub) and                                  \
+           isinstance(node.operand, ast.Constant) and                         \
+           (type(node.operand.value) in (int, float)):
+            value = _render(node.operand)
+            if value is not None:
+                return "-" + value
+    elif isinstance(node, (ast.List, ast.Set, ast.Tuple)):
+        items = _render_all(node.elts)
+        if items is None:
+            return None
+        elif isinstance(node, ast.List):
+            return "[{:}]".format(", ".join(items))
+        elif isinstance(node, ast.Set):
+            if items:
+                return "{{{:}}}".format(", ".join(items))
+        elif len(items) == 1:
+            return "({:},)".format(items[0])
+        else:
+            return "({:})".format(", ".join(items))
+    elif isinstance(node, ast.Dict):
+        if None not in node.keys:
+            keys = _render_all(node.keys)
+            values = _render_all(node.values)
+            if (keys is not None) and (values is not None):
+                return "{{{:}}}".format(", ".join(
+                    k + ": " + v for k, v in zip(keys, values)))
+    elif isinstance(node, ast.Subscript):
+        if isinstance(node.value, (ast.Name, ast.Attribute)):
+            value = _render(node.value)
+            index = node.slice
+            if isinstance(index, ast.Tuple):
+                index = _render_all(index.elts) if len(index.elts) > 1       \
+                        else None
+                if index is not None:
+                    index = ", ".join(index)
+            else:
+                index = _render(index)
+            if (value is not None) and (index is not None):
+                return "{:}[{:}]".format(value, index)
+    elif isinstance(node, ast.Call):
+        if isinstance(node.func, (ast.Name, ast.Attribute)) and              \
+           all(k.arg is not None for k in node.keywords):
+            func = _render(node.func)
+            args = _render_all(node.args)
+            values = _render_all([k.value for k in node.keywords])
+            if (func is not None) and (args is not None) and                 \
+               (values is not None):
+                args += [k.arg + "=" + v
+                         for k, v in zip(node.keywords, values)]
+                return "{:}({:})".format(func, ", ".join(args))
+
+    return None
+
+
+def _render_arg(arg, default=None):
+    """Render a function argument, or get `None` if it is unusual"""
+
+    text = arg.arg
+    annotation = arg.annotation
+    if annotation is not None:
+        # astor encloses numeric annotations in parentheses
+        if (not _UNPARSE) and (isinstance(annotation, ast.UnaryOp) or
+                               (isinstance(annotation, ast.Constant) and
+                                isinstance(annotation.value,
+                                           (int, float, complex)))):
+            return None
+        annotation = _render(annotation)
+        if annotation is None:
+            return None
+        text += ": " + annotation
+    if default is not None:
+        default = _render(default)
+        if default is None:
+            return None
+        text += "=" + default
+    return text
+
+
+def _render_arguments(node):
+    """Render a prototype as the backend does, or get `None` if it is
+    unusual"""
+
+    parts = []
+
+    def render(args, defaults):
+        padding = (len(args) - len(defaults)) * [None]
+        for arg, default in zip(args, padding + defaults):
+            parts.append(_render_arg(arg, default))
+
+    posonlyargs = getattr(node, "posonlyargs", [])
+    offset = 0
+    if posonlyargs:
+        offset += len(node.defaults) - len(node.args)
+        render(posonlyargs, node.defaults[:offset])
+        parts.append("/")
+    render(node.args, node.defaults[offset:])
+    if node.vararg is not None:
+        vararg = _render_arg(node.vararg)
+        parts.append(None if vararg is None else "*" + vararg)
+    if node.kwonlyargs:
+        if node.vararg is None:
+            parts.append("*")
+        render(node.kwonlyargs, node.kw_defaults)
+    if node.kwarg is not None:
+        kwarg = _render_arg(node.kwarg)
+        parts.append(None if kwarg is None else "**" + kwarg)
+
+    if None in parts:
+        return None
+    return ", ".join(parts)
+
+
+def _to_source(node):
+    """Render a syntax tree node as source code, without trailing newline
+
+    Usual prototypes and class bases are rendered directly, identically to
+    the backend. Other nodes are rendered with `ast.unparse`, or with astor
+    before Python 3.9.
+    """
+
+    if isinstance(node, ast.arguments):
+        text = _render_arguments(node)
+    elif isinstance(node, (ast.Attribute, ast.Call, ast.Name, ast.Subscript)):
+        text = _render(node)
     else:
-        return { "count": None, "categories": None }
+        text = None
+
+    if _UNPARSE:
+        return ast.unparse(node) if text is None else text
+
+    # astor wraps lines longer than 79 characters
+    if (text is not None) and (len(text) <= 79):
+        return text
+
+    import astor
+    return astor.to_source(node)[:-1]
+
 
+def _parse_assign(node):
+    """Parse an ast.Assign node"""
+    return ", ".join([t.id for t in node.targets])
 
-def gather_doc(package_dir, package_name):
-    """Gather public objects and their associated docstrings"""
+
+_re_section = re.compile(
+    "{0:} *(\\w*) *[:]? *{0:} *---* *{0:}".format(os.linesep))
+
+
+def gather_module(package_dir, path, check_imports=False, source=None):
+    """Gather the public objects of a module and their docstrings
+
+    Returns the module data and its documentation statistics, or `None` if
+    no token was found. The syntax tree of the shared *source* is used if
+    provided.
+    """
 
     # Container for documentation statistics
     statistics = {}
@@ -154,11 +1132,12 @@ def gather_doc(package_dir, package_name):
     def register_error(path, tag, lineno, message):
         """Helper function for recording a doc error"""
 
-        # Unpack the error data
+        # Unpack the error data. Messages are stored as the keys of a dict,
+        # i.e. as a set, and sorted eventually for a reproducible output
         try:
             data = statistics[path]
         except KeyError:
-            data = set([])
+            data = {}
             tmp = {"tokens": {tag: [lineno, data]}, "n_errors": 0,
                    "n_tokens": 0}
             statistics[path] = tmp
@@ -166,7 +1145,7 @@ def gather_doc(package_dir, package_name):
             try:
                 data = data["tokens"][tag]
             except KeyError:
-                tmp = set([])
+                tmp = {}
                 data["tokens"][tag] = [lineno, tmp]
                 data = tmp
             else:
@@ -174,45 +1153,20 @@ def gather_doc(package_dir, package_name):
 
         # Update the error data
         n = len(data)
-        data.add(message)
+        data[message] = None
         if len(data) > n:
             statistics[path]["n_errors"] += 1
 
-    def get_doc(node):
-        """Get the docstring of a node"""
-        try:
-            doc = ast.get_docstring(node, clean=True)
-        except:
-            return ""
-        else:
-            if doc is None:
-                doc = ""
-            return doc
-
-    def get_docstr(nodes, index):
-        """Try to get a docstring at the given index"""
-        try:
-            n = nodes[index]
-        except IndexError:
-            pass
-        else:
-            if isinstance(n, ast.Expr) and isinstance(n.value, ast.Str):
-                return n.value.s
-        return ""
-
-    re_section = re.compile(
-        "{0:} *(\\w*) *[:]? *{0:} *---* *{0:}".format(os.linesep))
-
     def get_function_doc(path, prefix, node):
         """Parse a function or method docstring in numpy style"""
 
         # Initialise the function meta from the AST
         function_tag = prefix + node.name
         function_line = node.lineno
-        docstr = get_doc(node)
+        docstr = _get_doc(node)
         params = {}
         meta = {"parameters": params,
-                "prototype": astor.to_source(node.args)[:-1]}
+                "prototype": _to_source(node.args)}
         args = node.args
         tags = [a.arg for i, a in enumerate(args.args)
                 if (i > 0) or ((a.arg != "self") and (a.arg != "cls"))]
@@ -239,7 +1193,7 @@ def gather_doc(package_dir, package_name):
             return docstr, meta
 
         # Parse the docstring
-        sections = re_section.split(docstr)
+        sections = _re_section.split(docstr)
         if len(sections) == 1:
             return validated()
 
@@ -292,142 +1246,220 @@ def gather_doc(package_dir, package_name):
         # Return the validated data
         return validated()
 
-    def parse_assign(node):
-        """Parse an ast.Assign node"""
-        return ", ".join([t.id for t in node.targets])
-
-    def gather_module(path, data, check_imports=False):
-        """Gather module top level nodes"""
-
-        with open(os.path.join(package_dir, path)) as f:
-            module = ast.parse(f.read())
-
-        doc = ast.get_docstring(module, clean=True)
-        if doc is not None:
-            doc = doc.split("\n\nCopyright (C)", 1)[0]
-        data["doc"] = doc
-
-        classes, definitions, functions, imports = {}, {}, {}, {}
-        data["classes"] = classes
-        data["definitions"] = definitions
-        data["functions"] = functions
-        data["imports"] = imports
-        data["path"] = path
-
-        for index, node in enumerate(module.body):
-            docstr = None
-
-            # Check the object type
-            if isinstance(node, ast.ClassDef):
-                bases = [astor.to_source(b)[:-1] for b in node.bases]
-                bases = [b for b in bases if b != "object"]
-
-                meths, attrs = {}, {}
-                extra = {"attributes": attrs, "methods": meths, "bases": bases}
-                for i, subnode in enumerate(node.body):
-                    if isinstance(subnode, ast.FunctionDef):
-                        doc, meta = get_function_doc(
-                            path, node.name + ".", subnode)
-                        meths[subnode.name] = (subnode.lineno, doc, meta)
-                    elif isinstance(subnode, ast.Assign):
-                        name = parse_assign(subnode)
-                        doc = get_docstr(node.body, i+1)
-                        if not doc:
-                            register_error(path, node.name, node.lineno,
-                                "Undocumented attribute `{}`".format(name))
-                        increment_tokens(path)
-                        attrs[name] = (subnode.lineno, doc, None)
-
-                container, name = classes, node.name
-            elif isinstance(node, ast.FunctionDef):
-                docstr, extra = get_function_doc(path, "", node)
-                container, name = functions, node.name
-            elif isinstance(node, ast.Assign):
-                name = parse_assign(node)
-                if name == "__all__":
-                    data[name] = [a.s for a in node.value.elts]
-                    continue
-                extra = None
-                docstr = get_docstr(module.body, index + 1)
-                container = definitions
-            elif check_imports and isinstance(node, ast.ImportFrom):
-                # Skip global imports
-                if node.level == 0:
-                    continue
+    if source is None:
+        source = load_source(os.path.join(package_dir, path))
+    module = source.tree
+
+    data = {}
+    doc = ast.get_docstring(module, clean=True)
+    if doc is not None:
+        doc = doc.split("\n\nCopyright (C)", 1)[0]
+    data["doc"] = doc
+
+    classes, definitions, functions, imports = {}, {}, {}, {}
+    data["classes"] = classes
+    data["definitions"] = definitions
+    data["functions"] = functions
+    data["imports"] = imports
+    data["path"] = path
+
+    for index, node in enumerate(module.body):
+        docstr = None
+
+        # Check the object type
+        if isinstance(node, ast.ClassDef):
+            bases = [_to_source(b) for b in node.bases]
+            bases = [b for b in bases if b != "object"]
+
+            meths, attrs = {}, {}
+            extra = {"attributes": attrs, "methods": meths, "bases": bases}
+            for i, subnode in enumerate(node.body):
+                if isinstance(subnode, ast.FunctionDef):
+                    doc, meta = get_function_doc(
+                        path, node.name + ".", subnode)
+                    meths[subnode.name] = (subnode.lineno, doc, meta)
+                elif isinstance(subnode, ast.Assign):
+                    name = _parse_assign(subnode)
+                    doc = _get_docstr(node.body, i+1)
+                    if not doc:
+                        register_error(path, node.name, node.lineno,
+                            "Undocumented attribute `{}`".format(name))
+                    increment_tokens(path)
+                    attrs[name] = (subnode.lineno, doc, None)
+
+            container, name = classes, node.name
+        elif isinstance(node, ast.FunctionDef):
+            docstr, extra = get_function_doc(path, "", node)
+            container, name = functions, node.name
+        elif isinstance(node, ast.Assign):
+            name = _parse_assign(node)
+            if name == "__all__":
+                data[name] = [a.s for a in node.value.elts]
+                continue
+            extra = None
+            docstr = _get_docstr(module.body, index + 1)
+            container = definitions
+        elif check_imports and isinstance(node, ast.ImportFrom):
+            # Skip global imports
+            if node.level == 0:
+                continue
 
-                # Create or get the container
-                module_name = node.module if node.module is not None else ""
+            # Create or get the container
+            module_name = node.module if node.module is not None else ""
+            try:
+                ii = imports[node.level]
+            except KeyError:
+                i = []
+                imports[node.level] = {module_name: i}
+            else:
                 try:
-                    ii = imports[node.level]
+                    i = ii[module_name]
                 except KeyError:
                     i = []
-                    imports[node.level] = {module_name: i}
-                else:
-                    try:
-                        i = ii[module_name]
-                    except KeyError:
-                        i = []
-                        ii[module_name] = i
-
-                # Append the symbol and its alias to the liss of imports
-                for a in node.names:
-                    asname = a.asname
-                    if asname is None:
-                        asname = a.name
-                    i.append((a.name, asname))
-                continue
-            else:
-                continue
+                    ii[module_name] = i
+
+            # Append the symbol and its alias to the liss of imports
+            for a in node.names:
+                asname = a.asname
+                if asname is None:
+                    asname = a.name
+                i.append((a.name, asname))
+            continue
+        else:
+            continue
 
-            if name.startswith("_"):
-                continue
+        if name.startswith("_"):
+            continue
 
-            if docstr is None:
-                docstr = get_doc(node)
-            if not docstr:
-                register_error(path, name, node.lineno, "Missing description")
-            increment_tokens(path)
+        if docstr is None:
+            docstr = _get_doc(node)
+        if not docstr:
+            register_error(path, name, node.lineno, "Missing description")
+        increment_tokens(path)
 
-            container[name] = (node.lineno, docstr, extra)
+        container[name] = (node.lineno, docstr, extra)
 
+    # Convert the statistics data to sorted lists, for JSON
+    for _, outer in statistics.items():
+        for _, inner in outer["tokens"].items():
+            inner[1] = sorted(inner[1])
 
-    # Parse the package and its submodules recursively
-    def parse(path, data):
-        # Gather the top level doc
-        gather_module(os.path.join(path, "__init__.py"), data,
-                      check_imports=True)
+    return data, statistics.get(path, None)
+
+
+def _is_module(basename):
+    """Check if a file is a documented sub-module"""
+    return (basename != "__init__.py") and (basename != "version.py") and   \
+           not basename.startswith("_")
 
-        # Gather sub modules
-        modules = {}
-        data["modules"] = modules
+
+def _list_modules(package_dir, package_name, tree=None):
+    """List the documented modules of a package, recursively
+
+    Returns a list of `(path, vpath, is_package)` tuples where *vpath* is the
+    vector path of module names.
+    """
+
+    if tree is None:
+        tree = ScanTree(os.path.join(package_dir, package_name),
+                        package_dir)
+
+    modules = []
+
+    def parse(path, vpath):
+        modules.append((os.path.join(path, "__init__.py"), vpath, True))
 
         abspath = os.path.join(package_dir, path)
-        for filename in glob.glob(os.path.join(abspath, "*.py")):
-            basename = os.path.basename(filename)
-            if (basename == "__init__.py") or (basename == "version.py") or    \
-                basename.startswith("_"):
+        dirnames, filenames = tree.listdir(abspath)
+        for basename in filenames:
+            if not basename.endswith(".py") or basename.startswith(".") or \
+               not _is_module(basename):
                 continue
             name, _ = os.path.splitext(basename)
+            modules.append((os.path.join(path, basename), vpath + [name],
+                            False))
 
-            d = {}
-            modules[name] = d
-            gather_module(os.path.join(path, basename), d)
-
-        for dirname in os.listdir(abspath):
-            if not os.path.exists(
-                os.path.join(abspath, dirname, "__init__.py")):
+        for dirname in dirnames:
+            if not tree.isfile(os.path.join(abspath, dirname, "__init__.py")):
                 continue
+            parse(os.path.join(path, dirname), vpath + [dirname])
+
+    parse(package_name, [])
+    return modules
+
+
+def _compact(value):
+    """Compact documentation data, for keeping it in memory
+
+    Lists are replaced by tuples and strings are interned, e.g. paths, tags
+    and error messages, which repeat across modules. Dictionaries are
+    updated in place. The JSON encoding of the data is unchanged.
+    """
+    if isinstance(value, str):
+        return sys.intern(value)
+    elif isinstance(value, dict):
+        items = list(value.items())
+        value.clear()
+        for k, v in items:
+            if isinstance(k, str):
+                k = sys.intern(k)
+            value[k] = _compact(v)
+        return value
+    elif isinstance(value, (list, tuple)):
+        return tuple(_compact(v) for v in value)
+    else:
+        return value
+
+
+def gather_doc(package_dir, package_name, doc=None, changes=None,
+               cache=None, executor=None, results=None, tree=None):
+    """Gather public objects and their associated docstrings
+
+    If the *doc* of a previous analysis is provided, together with a list of
+    `(status, path)` *changes*, only the modified modules are gathered again
+    and merged into *doc*. Modules are read from the *tree* if any, or from
+    the disk otherwise.
+    """
+
+    # Modules are gathered in bulk, once the package layout is known
+    tasks = []
+
+    def gather(path, data, check_imports=False):
+        """Schedule the gathering of a module"""
+        tasks.append((path, data, check_imports))
+
+    def gather_all():
+        """Gather the scheduled modules and record their statistics"""
+        kinds = {False: "doc", True: "doc-init"}
+        args = [(os.path.join(package_dir, path), kinds[check_imports])
+                for path, _, check_imports in tasks]
+        values = _analyse_files(args, cache, executor, results, tree)
+        for (path, data, _), (d, s) in zip(tasks, values):
+            path = sys.intern(path)
+            _compact(d)
+            _compact(s)
+            d["path"] = path
+            modules = data.pop("modules", None)
+            data.update(d)
+            if modules is not None:
+                data["modules"] = modules
+            if s is not None:
+                statistics[path] = s
+        del tasks[:]
 
-            d = {}
-            modules[dirname] = d
-            parse(os.path.join(path, dirname), d)
-
-    # Generate the doc, starting from the top level
-    data = {"statistics": statistics}
-    parse(package_name, data)
+    # Parse the package and its submodules recursively
+    def parse():
+        for path, vpath, is_package in _list_modules(package_dir,
+                                                     package_name, tree):
+            if vpath:
+                d = {}
+                get_module(vpath[:-1])["modules"][vpath[-1]] = d
+            else:
+                d = data
+            if is_package:
+                d["modules"] = {}
+            gather(path, d, check_imports=is_package)
 
-    # Update the doc with local imports
-    #
     def get_module(vpath):
         # Get a module given a vector path of module names
         module = data
@@ -438,70 +1470,154 @@ def gather_doc(package_dir, package_name):
                 return None
         return module
 
-    def update_module(source_path):
-        # Get the source module
-        source = get_module(source_path)
+    # Merge the modified modules into the previous doc
+    def merge(changes):
+        # Strip re-exported symbols. They are resolved again afterwards
+        def strip(module):
+            for category in ("classes", "definitions", "functions"):
+                symbols = module[category]
+                for name in [k for k, v in symbols.items() if len(v) > 3]:
+                    del symbols[name]
+            for submodule in module.get("modules", {}).values():
+                strip(submodule)
+
+        strip(data)
+
+        for status, path in changes:
+            dirname, basename = os.path.split(path)
+            if not basename.endswith(".py"):
+                continue
+            module = get_module(dirname.split("/")[1:])
+            if module is None:
+                # This is not a sub-module of the package
+                continue
+
+            statistics.pop(path, None)
+            if basename == "__init__.py":
+                if status in ("A", "D"):
+                    # The package layout changed
+                    return False
+                for key in [k for k in module.keys()
+                            if k not in ("statistics", "modules")]:
+                    del module[key]
+                gather(path, module, check_imports=True)
+            elif _is_module(basename):
+                name, _ = os.path.splitext(basename)
+                if status == "D":
+                    module["modules"].pop(name, None)
+                else:
+                    d = {}
+                    module["modules"][name] = d
+                    gather(path, d)
+        return True
+
+    # Generate the doc, starting from the top level
+    if (doc is not None) and (changes is not None):
+        if not any(path.endswith(".py") for _, path in changes):
+            # Modules are unchanged, thus so are their re-exports
+            return doc
+        data, statistics = _compact(doc), doc["statistics"]
+        if not merge(changes):
+            return gather_doc(package_dir, package_name, cache=cache,
+                              executor=executor, results=results, tree=tree)
+    else:
+        statistics = {}
+        data = {"statistics": statistics}
+        parse()
+    gather_all()
 
-        # Check for local imports in the source, i.e. `__init__.py`
+    # Index the modules by path
+    modules = {}
+
+    def index(vpath, module):
+        modules[vpath] = module
+        for name, submodule in module.get("modules", {}).items():
+            index(vpath + (name,), submodule)
+
+    index((), data)
+
+    # Resolve local imports, i.e. re-exports, with a flat symbol table per
+    # module. The sources of a module are resolved first, such that chained
+    # re-exports resolve as well
+    symbols, resolving = {}, set()
+    categories = ("classes", "definitions", "functions")
+
+    def get_symbols(vpath):
+        """Get the symbols of a module, resolving its imports first"""
         try:
-            source_imports = source["imports"]
+            return symbols[vpath]
         except KeyError:
-            return
+            pass
 
-        # Get the target module
-        for level, iimps in source_imports.items():
-            level = level - 1
+        # In case of circular imports, the symbols resolved so far are used
+        module = modules[vpath]
+        cycle = vpath in resolving
+        if not cycle:
+            resolving.add(vpath)
+            resolve(vpath, module)
+            resolving.remove(vpath)
+
+        table = {}
+        for category in reversed(categories):
+            for name, info in module[category].items():
+                table[name] = (category, info)
+        if not cycle:
+            symbols[vpath] = table
+        return table
+
+    def resolve(vpath, module):
+        """Add the symbols imported by a module"""
+        for level, iimps in module.get("imports", {}).items():
+            level = int(level) - 1
             for module_name, imps in iimps.items():
-                if level:
-                    module_path = source_path[:-level]
-                else:
-                    module_path = source_path[:]
-                module_path += module_name.split(".")
-
-                module = get_module(module_path)
-                if module is None:
+                source_path = vpath[:-level] if level else vpath
+                source_path += tuple(module_name.split("."))
+                try:
+                    source = modules[source_path]
+                except KeyError:
                     continue
+                table = get_symbols(source_path)
 
-                # Expand start imports
+                # Expand star imports
                 for (name, alias) in imps:
                     if name == "*":
                         try:
-                            symbols = module["__all__"]
+                            names = source["__all__"]
                         except KeyError:
-                            symbols = list(module["classes"].keys()) +         \
-                                      list(module["definitions"].keys()) +     \
-                                      list(module["functions"].keys())
-                        imps = [(s, s) for s in symbols]
+                            names = [name for category in categories
+                                     for name in source[category].keys()]
+                        imps = [(s, s) for s in names]
                         break
 
-                # Update the source module
+                # Update the module
                 for (name, alias) in imps:
-                    for category in ("classes", "definitions", "functions"):
-                        if name in module[category]:
-                            break
-                    else:
+                    try:
+                        category, info = table[name]
+                    except KeyError:
                         continue
-                    info = module[category][name]
-                    source[category][alias] = (*info, module["path"])
+                    if len(info) <= 3:
+                        # Re-exports refer to the defining module
+                        info = (*info, source["path"])
+                    module[category][alias] = info
 
-        # Process the submodule(s)
-        try:
-            source_modules = source["modules"]
-        except KeyError:
-            return
+    for vpath in modules.keys():
+        get_symbols(vpath)
 
-        for module_name in source_modules.keys():
-            update_module(source_path + [module_name])
+    return data
 
-    # Update the module data recursively
-    update_module([])
 
-    # Convert the statistics data to tuples, for JSON
-    for _, outer in statistics.items():
-        for _, inner in outer["tokens"].items():
-            inner[1] = [v for v in inner[1]]
+def _gather_source(source, check_imports=False):
+    """Gather the documentation of a shared source"""
+    return gather_module(None, source.path, check_imports, source)
 
-    return data
+
+_ANALYSERS = {
+    "lines": _count_source_lines,
+    "pep8": lambda source: check_style_in(source.path, source),
+    "doc": _gather_source,
+    "doc-init": functools.partial(_gather_source, check_imports=True)
+}
+"""Analysers of shared sources, by kind"""
 
 
 def _Informer():
@@ -525,36 +1641,337 @@ _inform = _Informer()
 """Log messages to the terminal""" 
 
 
-def analyse_package(package_dir, stats):
-    """Analyse the content of a package and dump its statistics"""
+def _stage(name):
+    """Measure a processing stage, if profiling"""
+    recorder = profiler.get_profiler()
+    if recorder is None:
+        return contextlib.nullcontext()
+    return recorder.stage(name)
+
+
+def update_package(package_dir, stats, changes, cache=None, tree=None,
+                   executor=None):
+    """Update the statistics of a package given a list of staged changes
+
+    The recorded contribution of each modified file is replaced by its
+    current one, read from the *tree* if any. The modified files are
+    analysed in bulk, with the *executor* if any. Returns `False` if the
+    previous statistics cannot be updated incrementally, e.g. if they do not
+    hold per file counts.
+    """
+
+    if tree is None:
+        tree = DiskTree()
+
+    try:
+        lines, pep8 = stats["lines"], stats["pep8"]
+        version = stats["manager"]["version"]
+        stats["doc"]
+        counts = [lines[key] for key in _LINE_KEYS]
+        line_files = dict(lines["files"])
+    except (KeyError, TypeError):
+        return False
+    if version != __version__:
+        return False
+
+    if pep8["count"] is None:
+        categories = None
+        kinds = ["lines"]
+    else:
+        categories = {code: [int(n), message]
+                      for n, code, message in pep8["categories"]}
+        files = pep8.get("files", None)
+        if files is None:
+            return False
+        files = dict(files)
+        kinds = ["lines", "pep8"]
+
+    def remove(path):
+        """Remove the recorded contribution of a file"""
+        # The lines, as the PEP8 errors, are known per file
+        for i, ci in enumerate(line_files.pop(path, ())):
+            counts[i] -= ci
+        if categories is not None:
+            previous = files.pop(path, {})
+            _merge_style(categories, {code: [n, None] for code, n
+                                      in previous.items()}, -1)
+
+    def add(path, values):
+        """Add the current contribution of a file"""
+        for i, ci in enumerate(values[0]):
+            counts[i] += ci
+        if any(values[0]):
+            line_files[path] = list(values[0])
+        if categories is not None:
+            _merge_style(categories, values[1])
+            errors = _count_style(values[1])
+            if errors:
+                files[path] = errors
+
+    changes = [(status, path) for status, path in changes
+               if os.path.splitext(path)[1] == ".py"]
+
+    # Analyse the current content of the modified files, at once
+    current = []
+    for status, path in changes:
+        file_ = os.path.join(package_dir, path)
+        if (status != "D") and tree.isfile(file_):
+            basename = os.path.basename(path)
+            tasks = [(file_, kind) for kind in kinds]
+            if basename == "__init__.py":
+                tasks.append((file_, "doc-init"))
+            elif _is_module(basename):
+                tasks.append((file_, "doc"))
+            current.append((path, tasks))
+    results = {}
+    with _stage("files"):
+        _analyse_files([task for _, tasks in current for task in tasks],
+                       cache, executor, results, tree)
+    current = dict(current)
+
+    # Replace the recorded content by the current one
+    with _stage("merge"):
+        for status, path in changes:
+            remove(path)
+            if path in current:
+                add(path, [results[task] for task in current[path]])
+
+    stats["lines"] = _format_lines(counts, line_files)
+    if categories is not None:
+        stats["pep8"] = _format_style(categories, files)
 
     package_name = stats["package"]["name"]
+    with _stage("doc"):
+        stats["doc"] = gather_doc(package_dir, package_name, stats["doc"],
+                                  changes, cache, executor, results, tree)
+
+    return True
+
+
+def gather_stats(package_dir, package_name, cache=None, executor=None,
+                 tree=None):
+    """Gather the lines, PEP8 and documentation statistics of a package
+
+    Package files are read from the *tree* if any. Otherwise, the package
+    directory is scanned once, skipping the paths excluded by `.gitignore`
+    files, e.g. build directories or virtual environments.
+    """
+
+    # Run all analysers at once, such that each source file is loaded only
+    # once
     path = os.path.join(package_dir, package_name)
+    with _stage("scan"):
+        if tree is None:
+            tree = ScanTree(path, package_dir)
+        kinds = {False: "doc", True: "doc-init"}
+        tasks = [(file_, "lines") for file_ in _list_sources(path, tree)]
+        style_guide = _get_style_guide()
+        if style_guide is not None:
+            tasks += [(file_, "pep8") for file_ in
+                      _walk_style(style_guide, path, tree)]
+        tasks += [(os.path.join(package_dir, module), kinds[is_package])
+                  for module, _, is_package
+                  in _list_modules(package_dir, package_name, tree)]
+    results = {}
+    with _stage("files"):
+        _analyse_files(tasks, cache, executor, results, tree)
+
+    stats = {}
+    with _stage("lines"):
+        stats["lines"] = count_lines(path, results=results, tree=tree)
+    with _stage("pep8"):
+        stats["pep8"] = check_style(path, results=results, tree=tree)
+    with _stage("doc"):
+        stats["doc"] = gather_doc(package_dir, package_name,
+                                  results=results, tree=tree)
+    return stats
+
 
-    _inform("Counting lines ...")
-    stats["lines"] = count_lines(path)
+def _get_umask():
+    """Get the file mode creation mask of the process"""
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
 
-    _inform("Checking style ...")
-    stats["pep8"] = check_style(path)
 
-    _inform("Building the documentation ...")
-    stats["doc"] = gather_doc(package_dir, package_name)
+def _update_file(path, write, session=None):
+    """Update a generated file and stage it, if its content changed
+
+    The content is written by the *write* function to a temporary file,
+    which atomically replaces *path* if it differs. Otherwise, the file is
+    staged only if the staged content differs, as read through the git
+    *session*. Without a session, it is staged anyway. Returns `True` if the
+    file was written or staged.
+    """
+
+    dirname, basename = os.path.split(path)
+    fd, tmp = tempfile.mkstemp(prefix="." + basename + ".", dir=dirname)
+    try:
+        with os.fdopen(fd, "w") as f:
+            write(f)
+
+        if os.path.isfile(path) and filecmp.cmp(tmp, path, shallow=False):
+            if session is not None:
+                relpath = os.path.relpath(path, session.path or os.curdir)
+                staged, = session.read_objects([":./" + relpath])
+                with open(tmp, "rb") as f:
+                    if f.read() == staged:
+                        return False
+        else:
+            try:
+                mode = os.stat(path).st_mode & 0o7777
+            except FileNotFoundError:
+                mode = 0o666 & ~_get_umask()
+            os.chmod(tmp, mode)
+            os.replace(tmp, path)
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp)
+
+    if session is None:
+        git("add", path)
+    else:
+        session.add(path)
+    return True
+
+
+def _dump_stats(package_dir, stats, shards=None, session=None):
+    """Dump the statistics of a package, and its documentation shards
+
+    If *shards* is `None`, the current layout is kept, i.e. the
+    documentation is sharded if the shards directory exists. Only the
+    modified files are written and staged. Stale shards are removed.
+    """
+
+    directory = os.path.join(package_dir, PKG_SHARDS)
+    if shards is None:
+        shards = os.path.isdir(directory)
+
+    def writer(data):
+        return lambda f: dump_json(data, f)
+
+    if shards:
+        index, docs = split_doc(stats["doc"], stats["package"]["name"])
+        meta = dict(stats)
+        meta["doc"] = index
+        os.makedirs(directory, exist_ok=True)
+        for name, shard in docs.items():
+            _update_file(os.path.join(directory, name + ".json"),
+                         writer(shard), session)
+    else:
+        meta, docs = stats, {}
+
+    if os.path.isdir(directory):
+        stale = [os.path.join(directory, basename) for basename
+                 in sorted(os.listdir(directory))
+                 if basename.endswith(".json") and basename[:-5] not in docs]
+        if stale:
+            args = ("rm", "-q", "--cached", "--ignore-unmatch", "--", *stale)
+            if session is None:
+                git(*args)
+            else:
+                session.run(*args)
+            for path in stale:
+                os.remove(path)
+        if not shards:
+            with contextlib.suppress(OSError):
+                os.rmdir(directory)
+
+    _update_file(os.path.join(package_dir, PKG_FILE), writer(meta), session)
+
+
+def analyse_package(package_dir, stats, changes=None, cache=None, jobs=None,
+                    session=None, tree=None, shards=None):
+    """Analyse the content of a package and dump its statistics
+
+    If a list of staged *changes* is provided, the previous statistics are
+    updated incrementally instead. Per file results are read from, and
+    stored to, the analysis *cache* if any. If *jobs* is larger than one,
+    files are analysed in parallel by a pool of processes. The statistics
+    file is written and staged only if its content changed. If a git
+    *session* is provided, it is staged when the session is flushed. Package
+    files are read from the *tree* if any, e.g. the git index, or from the
+    disk otherwise. If *shards* is `True`, the documentation is split in per
+    module shards. If `None`, the current layout is kept.
+    """
+
+    executor = _get_executor(jobs)
+    try:
+        if changes is not None:
+            _inform("Updating the statistics ...")
+            with _stage("update"):
+                updated = update_package(package_dir, stats, changes, cache,
+                                         tree, executor)
+        else:
+            updated = False
+
+        if not updated:
+            _inform("Analysing sources ...")
+            with _stage("gather"):
+                stats.update(gather_stats(
+                    package_dir, stats["package"]["name"], cache, executor,
+                    tree))
+    finally:
+        if executor is not None:
+            executor.shutdown()
 
     _inform("Dumping package manager info...")
     stats["manager"] = { "version": __version__, "git": __git__ }
 
-    path = os.path.join(package_dir, PKG_FILE)
-    with open(path, "w") as f:
-        json.dump(stats, f)
-        f.write(os.linesep)
+    # The profile summary covers the analysis, i.e. the stages completed so
+    # far
+    recorder = profiler.get_profiler()
+    if recorder is None:
+        stats.pop("profile", None)
+    else:
+        stats["profile"] = recorder.summary()
 
-    git("add", path)
+    with _stage("dump"):
+        _dump_stats(package_dir, stats, shards, session)
 
     return stats
 
 
-def update_readme(package_dir, stats):
-    """Update the package README"""
+def _get_commit_key(session, sha):
+    """Get the `(sha, parent, tree)` key of a commit
+
+    The parent is the first one, or `None` for a root commit.
+    """
+    parents, tree = session.run("show", "-s", "--format=%P%n%T",
+                                sha).split("\n")
+    return sha, (parents.split() or [None])[0], tree
+
+
+def record_stats(package_dir, stats, parent=None, duration=None, tree=None,
+                 commits=()):
+    """Append the summary of the statistics to the package store, if enabled
+
+    The *parent* commit, the *tree* of the commit in progress and the
+    *duration* of the analysis, in seconds, are recorded as well. Previous
+    records are bound to their *commits* first, given as `(sha, parent,
+    tree)` tuples.
+    """
+
+    import sqlite3
+    from .store import default_store, summarise
+
+    summary = summarise(stats)
+    summary["parent"] = parent
+    summary["tree"] = tree
+    summary["duration"] = duration
+    try:
+        store = default_store(package_dir)
+        if store is not None:
+            with store:
+                store.bind_commits(commits)
+                store.append((summary,))
+    except (OSError, sqlite3.Error):
+        # The store is only informative. Let us not fail the commit on it
+        pass
+
+
+def update_readme(package_dir, stats, session=None):
+    """Update the package README, if its content changed"""
 
     # Load the content of the user README file
     path = os.path.join(package_dir, "docs", "README.md")
@@ -639,13 +2056,21 @@ def update_readme(package_dir, stats):
         "https://pypi.org/project/" + dist_name,
         "pypi/v/{:}.svg", shield=(dist_name,))
 
-    path = os.path.join(package_dir, "README.md")
-    with open(path, "w") as f:
+    def write(f):
         f.write(os.linesep.join(preamble))
         f.write(2 * os.linesep)
         f.write(readme)
 
-    git("add", path)
+    _update_file(os.path.join(package_dir, "README.md"), write, session)
+
+
+_BANNER = """{:}\
+# =================================================================
+#      This commit has been analysed by grand-pkg {:}
+# =================================================================
+#{:}
+"""
+"""Banner of git commit messages"""
 
 
 def add_banner(msg):
@@ -656,25 +2081,109 @@ def add_banner(msg):
     except ValueError:
         return msg
 
-    return """{:}\
-# =================================================================
-#      This commit has been analysed by grand-pkg {:}
-# =================================================================
-#{:}
-""".format(head, __version__, tail)
+    return _BANNER.format(head, __version__, tail)
+
+
+def make_commit_msg_hook(python=None):
+    """Get the source of a standalone prepare-commit-msg hook
+
+    The hook only depends on the Python standard library, and the package
+    manager version is baked in. It is run by the *python* interpreter,
+    which defaults to the current one.
+    """
+
+    if python is None:
+        python = sys.executable
+    if (not python) or (" " in python):
+        shebang = "#!/usr/bin/env python3"
+    else:
+        shebang = "#!{:} -S".format(python)
+
+    return """\
+{shebang:}
+# -*- coding: utf-8 -*-
+\"\"\"
+Git hook for preparing the commit message
+
+This file is generated by the GRAND package manager. It only depends on the
+Python standard library.
+\"\"\"
+
+import sys
+
+BANNER = {banner!r}
+
+VERSION = {version!r}
+
+
+def add_banner(msg):
+    try:
+        head, tail = msg.split("#", 1)
+    except ValueError:
+        return msg
+    return BANNER.format(head, VERSION, tail)
+
+
+if __name__ == "__main__":
+    with open(sys.argv[1], "r") as f:
+        initial_msg = f.read()
+
+    msg = add_banner(initial_msg)
+
+    if msg is not initial_msg:
+        with open(sys.argv[1], "w") as f:
+            f.write(msg)
+""".format(shebang=shebang, banner=_BANNER, version=__version__)
 
 
 def pre_commit():
-    """Git hook for pre-processing a commit"""
+    """Git hook for pre-processing a commit
+
+    The commit is processed by the package daemon if it is running, or in
+    process otherwise.
+    """
+    code = daemon.request("pre-commit")
+    if code is None:
+        run_pre_commit()
+    sys.exit(code)
+
 
+def run_pre_commit(cache=None, tree=None):
+    """Pre-process a commit in process
+
+    The analysis *cache* and the *tree* of files default to the package ones.
+    The index is used instead of the *tree* if `GRAND_PKG_STAGED` or
+    `GRAND_PKG_INCREMENTAL` is set.
+    The documentation is split in shards, or merged back, according to
+    `GRAND_PKG_SHARDS`, if set.
+    """
+
+    t0 = time.perf_counter()
     package_dir = get_top_directory()
+    if cache is None:
+        cache = default_cache(package_dir)
+
+    profile = _getenv_flag("GRAND_PKG_PROFILE")
+    if profile:
+        profiler.start()
+    try:
+        _pre_commit(package_dir, cache, tree, t0)
+    finally:
+        if profile:
+            profiler.stop()
+
+
+def _pre_commit(package_dir, cache, tree, t0):
+    """Pre-process a commit, given its settings"""
 
     # Check for a package manager update
     _inform("Checking for a package manager update...")
-    path = os.path.join(package_dir, PKG_FILE)
+    incremental = _getenv_flag("GRAND_PKG_INCREMENTAL")
     try:
-        with open(path, "r") as f:
-            stats = json.load(f)
+        # Sharded documentation is not needed. It is either gathered again or
+        # updated from the committed statistics
+        with _stage("load"):
+            stats = load_stats(package_dir, doc=False)
     except FileNotFoundError:
         _inform("This is not a valid GRAND package. Aborting...")
         print()
@@ -691,12 +2200,89 @@ def pre_commit():
                 print()
                 sys.exit(1)
 
-    # Update the stats
-    analyse_package(package_dir, stats)
-
-    # Update the package README
-    _inform("Generating the README...")
-    update_readme(package_dir, stats)
+    with GitSession(package_dir) as session:
+        # Update the stats
+        package_name = stats["package"]["name"]
+        if incremental:
+            changes = get_staged_changes(package_name, session)
+        else:
+            changes = None
+        if changes is not None:
+            # The staged changes are applied to the committed statistics,
+            # not to the working tree ones, which might already include them,
+            # e.g. if a previous commit was aborted
+            with _stage("load"):
+                try:
+                    committed = load_stats(package_dir, session=session)
+                except (FileNotFoundError, ValueError):
+                    changes = None
+                else:
+                    for key in ("lines", "pep8", "doc", "manager"):
+                        stats.pop(key, None)
+                        if key in committed:
+                            stats[key] = committed[key]
+
+        # An incremental update removes the committed content of the
+        # modified files. Their staged content is added back, such that the
+        # statistics match the commit
+        if incremental or _getenv_flag("GRAND_PKG_STAGED"):
+            tree = GitTree.from_index(session, package_dir, package_name)
+        if os.getenv("GRAND_PKG_SHARDS", ""):
+            shards = _getenv_flag("GRAND_PKG_SHARDS")
+        else:
+            shards = None
+        with _stage("analyse"):
+            analyse_package(package_dir, stats, changes, cache=cache,
+                            jobs=_getenv_jobs(), session=session, tree=tree,
+                            shards=shards)
+
+        # Update the package README
+        _inform("Generating the README...")
+        with _stage("readme"):
+            update_readme(package_dir, stats, session)
+
+        # Stage the updated files
+        with _stage("stage"):
+            session.flush()
+
+        # Record the statistics, by parent and by tree. The latter is the
+        # tree of the commit, since the index is complete. The record of the
+        # previous commit, if any, is bound to its SHA-1
+        with _stage("store"):
+            try:
+                tree = session.run("write-tree")
+            except subprocess.CalledProcessError:
+                tree = None
+            commits = []
+            try:
+                parent = session.run("rev-parse", "--verify", "HEAD")
+            except subprocess.CalledProcessError:
+                parent = None
+            else:
+                commits.append(_get_commit_key(session, parent))
+            record_stats(package_dir, stats, parent,
+                         time.perf_counter() - t0, tree, commits)
+
+    # Dump the profile report
+    recorder = profiler.get_profiler()
+    if recorder is not None:
+        # The git directory is not `.git` for linked worktrees or sub-modules
+        try:
+            git_dir = os.path.join(package_dir, run_git(
+                "rev-parse", "--git-dir", cwd=package_dir, check=True))
+        except subprocess.CalledProcessError:
+            git_dir = None
+        path = profiler.default_report(package_dir, git_dir)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                dump_json(recorder.report(), f)
+        except OSError as e:
+            # The report is only informative. Let us not fail the commit on it
+            _inform("Could not write the profile: {:}".format(e), end=True)
+        else:
+            _inform("Profile written to {:}".format(path), end=True)
+        print()
 
     # Exit back to the OS
     _inform("", end=True)
@@ -704,7 +2290,21 @@ def pre_commit():
 
 
 def prepare_commit_msg(file_=None):
-    """Git hook for preparing the commit message"""
+    """Git hook for preparing the commit message
+
+    The message is prepared by the package daemon if it is running, or in
+    process otherwise.
+    """
+    if file_ is None:
+        file_ = sys.argv[1]
+    code = daemon.request("prepare-commit-msg", os.path.abspath(file_))
+    if code is None:
+        run_prepare_commit_msg(file_)
+    sys.exit(code)
+
+
+def run_prepare_commit_msg(file_=None):
+    """Prepare the commit message in process"""
     if file_ is None:
         file_ = sys.argv[1]
     with open(file_, "r") as f:
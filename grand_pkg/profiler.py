@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Profiling of the git hooks, per stage, analyser and file
+
+Copyright (C) 2018 The GRAND collaboration
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>
+"""
+
+import contextlib
+import os
+import time
+import tracemalloc
+
+__all__ = ["Profiler", "default_report", "get_profiler", "start", "stop"]
+
+
+def _accumulate(records, name, record):
+    """Add a record to the totals of a task
+
+    Times are summed while the peak memory is the largest one.
+    """
+    try:
+        total = records[name]
+    except KeyError:
+        records[name] = dict(record, count=1)
+        return
+    total["wall"] = round(total["wall"] + record["wall"], 6)
+    total["cpu"] = round(total["cpu"] + record["cpu"], 6)
+    total["memory"] = max(total["memory"], record["memory"])
+    total["count"] += 1
+
+
+class Profiler(object):
+    """Recorder of the wall time, CPU time and peak memory of tasks
+
+    Memory is traced with `tracemalloc`, i.e. only the Python allocations of
+    the current process are accounted for. The peak memory of a task is
+    given relative to the memory in use when it starts. Measurements can be
+    nested.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        """Records of the processing stages, by name"""
+
+        self.files = {}
+        """Records of the analysis of files, by path and by analyser"""
+
+        self._frames = []
+        self._names = []
+        self._tracing = tracemalloc.is_tracing()
+        if not self._tracing:
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def measure(self):
+        """Measure a task, yielding its record
+
+        The record is filled in when the task completes.
+        """
+
+        # The peak memory of the enclosing task is saved before being reset.
+        # Before Python 3.9, the peak cannot be reset. The largest one since
+        # the start of the profiling is used instead
+        _, peak = tracemalloc.get_traced_memory()
+        if self._frames:
+            self._frames[-1][1] = max(self._frames[-1][1], peak)
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        frame = [current, current]
+        self._frames.append(frame)
+
+        record = {}
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record["wall"] = round(time.perf_counter() - wall, 6)
+            record["cpu"] = round(time.process_time() - cpu, 6)
+            self._frames.pop()
+            _, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, frame[1])
+            record["memory"] = peak - frame[0]
+            if self._frames:
+                self._frames[-1][1] = max(self._frames[-1][1], peak)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Measure a processing stage
+
+        Stages are named after their enclosing stages, e.g. `analyse/doc`.
+        Repeated stages are accumulated.
+        """
+        self._names.append(name)
+        try:
+            with self.measure() as record:
+                yield
+        finally:
+            _accumulate(self.stages, "/".join(self._names), record)
+            self._names.pop()
+
+    def add_file(self, path, records):
+        """Add the records of the analysis of a file, by analyser"""
+        self.files.setdefault(path, {}).update(records)
+
+    def summary(self):
+        """Summarise the measurements, per stage and per analyser"""
+        analysers = {}
+        for records in self.files.values():
+            for name, record in records.items():
+                _accumulate(analysers, name, record)
+        return {"stages": self.stages, "analysers": analysers,
+                "n_files": len(self.files)}
+
+    def report(self):
+        """Get a full report, including the records of each file"""
+        report = self.summary()
+        report["files"] = self.files
+        return report
+
+
+_PROFILER = [None]
+"""The profiler of the current process, if any"""
+
+
+def get_profiler():
+    """Get the profiler of the current process, or `None`"""
+    return _PROFILER[0]
+
+
+def start():
+    """Start profiling the current process
+
+    Returns the profiler. A running profiler is kept.
+    """
+    if _PROFILER[0] is None:
+        _PROFILER[0] = Profiler()
+    return _PROFILER[0]
+
+
+def stop():
+    """Stop profiling the current process and return the profiler, if any"""
+    profiler, _PROFILER[0] = _PROFILER[0], None
+    if (profiler is not None) and not profiler._tracing:
+        tracemalloc.stop()
+    return profiler
+
+
+def default_report(package_dir, git_dir=None):
+    """Get the path to the default profile report of a package
+
+    The report is located under the *git_dir* directory if provided, e.g.
+    for a linked worktree or for a sub-module, or under the package `.git`
+    directory otherwise.
+    """
+    if git_dir is None:
+        git_dir = os.path.join(package_dir, ".git")
+    return os.path.join(git_dir, "grand-pkg", "profile.json")
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Shell free access to git, with long lived processes
+
+Copyright (C) 2018 The GRAND collaboration
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>
+"""
+
+import os
+import subprocess
+import threading
+
+__all__ = ["GitSession", "get_git_dir", "run_git"]
+
+
+def run_git(*args, cwd=None, check=False):
+    """Run a git command without spawning a shell
+
+    The standard output and error are merged and returned as a string, with
+    the trailing newline stripped, as `subprocess.getoutput` does. If *check*
+    is set, a `subprocess.CalledProcessError` is raised on failure.
+    """
+    p = subprocess.run(("git",) + args, cwd=cwd, stdin=subprocess.DEVNULL,
+                       stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    out = p.stdout.decode(errors="replace")
+    if out.endswith("\n"):
+        out = out[:-1]
+    if check and p.returncode:
+        raise subprocess.CalledProcessError(p.returncode, p.args, out)
+    return out
+
+
+def get_git_dir(path=None, common=False):
+    """Get the git directory of the repository holding *path*, if any
+
+    The git directory is not `.git` for linked worktrees and sub-modules. If
+    *common* is `True`, the directory shared by all the worktrees of the
+    repository is returned instead. `None` is returned if *path* is not in
+    a git repository.
+    """
+    option = "--git-common-dir" if common else "--git-dir"
+    try:
+        git_dir = run_git("rev-parse", option, cwd=path, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return os.path.abspath(os.path.join(path or os.curdir, git_dir))
+
+
+class GitSession(object):
+    """Session for accessing a git repository
+
+    Objects are read through a single `git cat-file --batch` process, started
+    on demand. Paths added to the index are grouped and staged by a single
+    `git add` call when the session is flushed. A session can be used as a
+    context manager, which flushes and closes it on exit.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._batch = None
+        self._added = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.flush()
+        finally:
+            self.close()
+        return False
+
+    def run(self, *args, check=True):
+        """Run a git command and return its output"""
+        return run_git(*args, cwd=self.path, check=check)
+
+    def read_objects(self, names):
+        """Read git objects, e.g. `HEAD:path/to/file` or a SHA-1
+
+        Returns the raw content of the objects, in the order of *names*. The
+        content is `None` for missing objects.
+        """
+
+        names = list(names)
+        if not names:
+            return []
+
+        if self._batch is None:
+            self._batch = subprocess.Popen(
+                ("git", "cat-file", "--batch"), cwd=self.path,
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        stdin, stdout = self._batch.stdin, self._batch.stdout
+
+        # Requests are written from a separate thread, such that the pipes
+        # cannot dead lock
+        def write():
+            for name in names:
+                stdin.write(name.encode() + b"\n")
+            stdin.flush()
+
+        writer = threading.Thread(target=write)
+        writer.start()
+
+        contents = []
+        try:
+            for _ in names:
+                header = stdout.readline()
+                if header.endswith((b" missing\n", b" ambiguous\n")):
+                    contents.append(None)
+                    continue
+                size = int(header.split()[-1])
+                contents.append(stdout.read(size))
+                stdout.read(1)
+        finally:
+            writer.join()
+
+        return contents
+
+    def read_object(self, name):
+        """Read a single git object"""
+        return self.read_objects((name,))[0]
+
+    def add(self, *paths):
+        """Schedule paths to be added to the index"""
+        self._added += paths
+
+    def flush(self):
+        """Add the scheduled paths to the index, at once"""
+        if self._added:
+            paths, self._added = self._added, []
+            self.run("add", "--", *paths)
+
+    def close(self):
+        """Terminate the long lived git processes"""
+        if self._batch is not None:
+            self._batch.stdin.close()
+            self._batch.wait()
+            self._batch.stdout.close()
+            self._batch = None
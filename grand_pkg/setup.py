@@ -29,6 +29,7 @@ import sys
 from distutils.core import Command
 from setuptools import setup, find_packages
 from . import PKG_FILE
+from .session import run_git
 
 try:
     system = subprocess.getoutput
@@ -103,13 +104,13 @@ def make_version_module(package, version):
 
     """
 
-    status = system("git status --porcelain")
+    status = run_git("status", "--porcelain")
     if status and not ("pip-delete-this-directory.txt" in str(status)):
         raise RuntimeError("Dirty git status")
 
-    sha1, author, date = map(lambda s: s.strip(), system(
-        "git show -s --format='%H|%cn|%ci' HEAD").split("|"))
-    count = system("git rev-list --count HEAD").strip()
+    sha1, author, date = map(lambda s: s.strip(), run_git(
+        "show", "-s", "--format=%H|%cn|%ci", "HEAD").split("|"))
+    count = run_git("rev-list", "--count", "HEAD").strip()
 
     content = os.linesep.join((
         "# -*- coding: utf-8 -*-",
@@ -0,0 +1,438 @@
+# -*- coding: utf-8 -*-
+"""
+Shared loader of Python sources for the package analysers
+
+Copyright (C) 2018 The GRAND collaboration
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>
+"""
+
+import ast
+import io
+import os
+import re
+import tokenize
+
+from .cache import blob_sha
+
+__all__ = ["DiskTree", "GitTree", "ScanTree", "Source",
+           "load_source"]
+
+
+class Source(object):
+    """Python source shared by all analysers
+
+    The raw *data* are read once. They are decoded, tokenized and parsed on
+    demand, at most once.
+    """
+
+    __slots__ = ("path", "data", "_sha", "_lines", "_tokens", "_token_error",
+                 "_tree")
+
+    def __init__(self, path, data, sha=None):
+        self.path = path
+        self.data = data
+        self._sha = sha
+        self._lines = None
+        self._tokens = None
+        self._token_error = None
+        self._tree = None
+
+    @property
+    def sha(self):
+        """The git blob SHA-1 of the raw content"""
+        if self._sha is None:
+            self._sha = blob_sha(self.data)
+        return self._sha
+
+    def _open(self):
+        """Open the raw content as a text stream, with universal newlines"""
+        stream = io.BytesIO(self.data)
+        try:
+            encoding, _ = tokenize.detect_encoding(stream.readline)
+        except SyntaxError:
+            encoding = "utf-8"
+        stream.seek(0)
+        return io.TextIOWrapper(stream, encoding)
+
+    @property
+    def lines(self):
+        """The decoded lines, as returned by `readlines`"""
+        if self._lines is None:
+            self._lines = self._open().readlines()
+        return self._lines
+
+    def iter_lines(self):
+        """Iterate over the decoded lines
+
+        The lines are decoded on the fly, without being kept, unless they
+        were already decoded.
+        """
+        if self._lines is None:
+            yield from self._open()
+        else:
+            yield from self._lines
+
+    @property
+    def text(self):
+        """The decoded content"""
+        return "".join(self.lines)
+
+    @property
+    def tokens(self):
+        """The token stream, up to the first tokenize error if any"""
+        if self._tokens is None:
+            self._tokens = []
+            readline = iter(self.lines).__next__
+            try:
+                for token in tokenize.generate_tokens(readline):
+                    self._tokens.append(token)
+            except (SyntaxError, tokenize.TokenError) as e:
+                self._token_error = e
+        return self._tokens
+
+    def iter_tokens(self):
+        """Iterate over the token stream
+
+        The tokens are decoded and tokenized on the fly, without being kept,
+        unless they were already computed. The tokenize error, if any, is
+        raised at the end of the stream.
+        """
+        if self._tokens is None:
+            yield from tokenize.generate_tokens(self._open().readline)
+        else:
+            yield from self._tokens
+            if self._token_error is not None:
+                raise self._token_error
+
+    @property
+    def token_error(self):
+        """The tokenize error, or `None`"""
+        self.tokens
+        return self._token_error
+
+    @property
+    def tree(self):
+        """The abstract syntax tree of the module"""
+        if self._tree is None:
+            self._tree = ast.parse(self.text)
+        return self._tree
+
+
+def load_source(path, data=None, sha=None):
+    """Load a source file, unless its raw *data* are provided"""
+    if data is None:
+        with open(path, "rb") as f:
+            data = f.read()
+    return Source(path, data, sha)
+
+
+class DiskTree(object):
+    """Tree of files on the disk"""
+
+    def walk(self, top):
+        """Walk the tree top-down, as `os.walk`"""
+        return os.walk(top)
+
+    def isdir(self, path):
+        """Check if a path is a directory"""
+        return os.path.isdir(path)
+
+    def isfile(self, path):
+        """Check if a path is a file"""
+        return os.path.isfile(path)
+
+    def listdir(self, path):
+        """List the sub-directories and the files of a directory"""
+        dirs, files = [], []
+        for entry in os.scandir(path):
+            if entry.is_dir():
+                dirs.append(entry.name)
+            else:
+                files.append(entry.name)
+        return dirs, files
+
+    def get_sha(self, path):
+        """The git blob SHA-1 of a file, if known without reading it"""
+        return None
+
+    def read(self, paths):
+        """Read the raw content of files, in bulk
+
+        `None` is returned for files that the analysers read by themselves,
+        e.g. in parallel. This is the case for all files on the disk. Once
+        read, the SHA-1 of a file, if known, must refer to the content
+        returned.
+        """
+        return len(paths) * [None]
+
+
+class _IndexedTree(DiskTree):
+    """Tree of files indexed in memory, by directory
+
+    The known files are mapped to their git blob SHA-1, or to `None`.
+    """
+
+    def __init__(self):
+        self._files = {}
+        self._dirs = {}
+
+    def _get_dir(self, path):
+        """Get the sub-directories and the files of a directory, or add it"""
+        try:
+            return self._dirs[path]
+        except KeyError:
+            d = ([], [])
+            self._dirs[path] = d
+            parent, name = os.path.split(path)
+            if name:
+                self._get_dir(parent)[0].append(name)
+            return d
+
+    def _add_file(self, path, sha=None):
+        """Add a file to the tree, and its parent directories if needed"""
+        self._files[path] = sha
+        dirname, basename = os.path.split(path)
+        self._get_dir(dirname)[1].append(basename)
+
+    def walk(self, top):
+        top = os.path.normpath(top)
+        try:
+            dirs, files = self._dirs[top]
+        except KeyError:
+            return
+        dirs = list(dirs)
+        yield top, dirs, list(files)
+        for name in dirs:
+            yield from self.walk(os.path.join(top, name))
+
+    def isdir(self, path):
+        return os.path.normpath(path) in self._dirs
+
+    def isfile(self, path):
+        return os.path.normpath(path) in self._files
+
+    def listdir(self, path):
+        dirs, files = self._dirs[os.path.normpath(path)]
+        return list(dirs), list(files)
+
+    def get_sha(self, path):
+        return self._files.get(os.path.normpath(path), None)
+
+
+def _compile_pattern(pattern):
+    """Compile a `.gitignore` pattern to a regular expression
+
+    Returns a `(regex, negate, directory_only)` tuple, or `None` for blank
+    lines and comments.
+    """
+
+    pattern = pattern.rstrip("\n").rstrip()
+    if (not pattern) or pattern.startswith("#"):
+        return None
+    negate = pattern.startswith("!")
+    if negate:
+        pattern = pattern[1:]
+    directory_only = pattern.endswith("/")
+    pattern = pattern.rstrip("/")
+    if not pattern:
+        return None
+
+    # Patterns with a separator are relative to the .gitignore directory.
+    # Others match at any level
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+
+    regex, i = [], 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            regex.append("(?:.*/)?")
+            i += 2
+        elif pattern.startswith("**", i):
+            regex.append(".*")
+            i += 1
+        elif c == "*":
+            regex.append("[^/]*")
+        elif c == "?":
+            regex.append("[^/]")
+        elif c == "[":
+            j = pattern.find("]", i + 2)
+            if j < 0:
+                regex.append("\\[")
+            else:
+                chars = pattern[i + 1:j].replace("\\", "\\\\")
+                if chars.startswith("!"):
+                    chars = "^" + chars[1:]
+                regex.append("[" + chars + "]")
+                i = j
+        elif (c == "\\") and (i + 1 < len(pattern)):
+            i += 1
+            regex.append(re.escape(pattern[i]))
+        else:
+            regex.append(re.escape(c))
+        i += 1
+
+    regex = "".join(regex)
+    if not anchored:
+        regex = "(?:.*/)?" + regex
+    return re.compile(regex + "$"), negate, directory_only
+
+
+def _read_ignore(path):
+    """Read the `.gitignore` rules of a directory
+
+    Returns a list of `(directory, regex, negate, directory_only)` tuples.
+    """
+
+    try:
+        with open(os.path.join(path, ".gitignore"), "r") as f:
+            lines = f.readlines()
+    except (OSError, UnicodeDecodeError):
+        return []
+
+    rules = []
+    for line in lines:
+        pattern = _compile_pattern(line)
+        if pattern is not None:
+            rules.append((path,) + pattern)
+    return rules
+
+
+def _is_ignored(rules, path, is_dir):
+    """Check if a path is excluded by `.gitignore` rules
+
+    The last matching rule wins, as for git.
+    """
+
+    ignored = False
+    for directory, regex, negate, directory_only in rules:
+        if directory_only and not is_dir:
+            continue
+        if directory == os.curdir:
+            relpath = path
+        else:
+            relpath = path[len(directory) + 1:]
+        if regex.match(relpath.replace(os.sep, "/")):
+            ignored = not negate
+    return ignored
+
+
+class ScanTree(_IndexedTree):
+    """Tree of files on the disk, indexed by a single scan
+
+    The *top* directory is scanned once, with `os.scandir`, and the
+    analysers consume the resulting index. Paths excluded by the
+    `.gitignore` files of the scanned directories are skipped, as well as
+    those of the parent directories up to *root*, if provided. Symbolic
+    links to directories are not followed, as for `os.walk`.
+    """
+
+    def __init__(self, top, root=None):
+        super().__init__()
+
+        top = os.path.normpath(top)
+        rules = []
+        if root is not None:
+            root = os.path.normpath(root)
+            relpath = os.path.relpath(top, root)
+            if not relpath.startswith(os.pardir):
+                path = root
+                rules += _read_ignore(path)
+                for name in relpath.split(os.sep)[:-1]:
+                    path = os.path.join(path, name)
+                    rules += _read_ignore(path)
+        if os.path.isdir(top):
+            self._scan(top, rules)
+
+    def _scan(self, path, rules):
+        """Index a directory, recursively"""
+
+        rules = rules + _read_ignore(path)
+        dirs, files = [], []
+        self._dirs[path] = (dirs, files)
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            return
+
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if _is_ignored(rules, entry.path, is_dir):
+                continue
+            if is_dir:
+                dirs.append(entry.name)
+                if not entry.is_symlink():
+                    self._scan(entry.path, rules)
+            else:
+                files.append(entry.name)
+                self._files[entry.path] = None
+
+
+class GitTree(_IndexedTree):
+    """Tree of files stored in git, e.g. staged in the index or committed
+
+    The tree is built from `(path, sha)` *entries*, with paths relative to
+    the *top* directory. Blobs are read in bulk through a git *session*.
+    """
+
+    def __init__(self, top, entries, session):
+        super().__init__()
+        self._session = session
+
+        top = os.path.normpath(top)
+        for path, sha in entries:
+            self._add_file(os.path.join(top, path), sha)
+
+    @classmethod
+    def from_index(cls, session, top, *paths):
+        """Build the tree of the files staged under *paths*
+
+        Symbolic links, sub-modules and unmerged entries are ignored.
+        """
+        output = session.run("ls-files", "--stage", "-z", "--", *paths)
+        entries = []
+        for entry in output.split("\0"):
+            try:
+                info, path = entry.split("\t", 1)
+                mode, sha, stage = info.split()
+            except ValueError:
+                continue
+            if (stage == "0") and mode.startswith("100"):
+                entries.append((path, sha))
+        return cls(top, entries, session)
+
+    @classmethod
+    def from_commit(cls, session, top, commit, *paths):
+        """Build the tree of the files committed under *paths*
+
+        Symbolic links and sub-modules are ignored.
+        """
+        output = session.run("ls-tree", "-r", "-z", commit, "--", *paths)
+        entries = []
+        for entry in output.split("\0"):
+            try:
+                info, path = entry.split("\t", 1)
+                mode, type_, sha = info.split()
+            except ValueError:
+                continue
+            if (type_ == "blob") and mode.startswith("100"):
+                entries.append((path, sha))
+        return cls(top, entries, session)
+
+    def read(self, paths):
+        return self._session.read_objects(self.get_sha(path) for path in paths)
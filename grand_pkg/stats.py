@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Storage of the package statistics, optionally split in shards
+
+Copyright (C) 2018 The GRAND collaboration
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>
+"""
+
+import json
+import os
+
+from . import PKG_FILE, PKG_SHARDS
+
+__all__ = ["assemble_doc", "dump_json", "is_sharded", "load_stats",
+           "split_doc"]
+
+
+def _iter_json(value, indent="\n"):
+    """Encode a value to canonical JSON, by chunks
+
+    Keys are sorted, as their JSON string. Dictionaries are split over
+    lines, one item per line, while other values are encoded on a single
+    line.
+    """
+    if isinstance(value, dict) and value:
+        # Keys are converted as by json, e.g. 1 to "1"
+        items = {(k if isinstance(k, str) else json.dumps(k)): v
+                 for k, v in value.items()}
+        inner = indent + " "
+        separator = "{" + inner
+        for k in sorted(items):
+            yield separator + json.dumps(k) + ": "
+            yield from _iter_json(items[k], inner)
+            separator = "," + inner
+        yield indent + "}"
+    else:
+        yield json.dumps(value, sort_keys=True)
+
+
+def dump_json(value, f):
+    """Dump statistics to a file, in canonical JSON
+
+    The output is stable and line oriented, such that small changes of the
+    statistics result in small diffs.
+    """
+    for chunk in _iter_json(value):
+        f.write(chunk)
+    f.write("\n")
+
+
+def is_sharded(doc):
+    """Check if the documentation statistics are an index of shards"""
+    return isinstance(doc, dict) and ("shards" in doc)
+
+
+def split_doc(doc, package_name):
+    """Split the documentation of a package in shards, one per module
+
+    Shards are named after the dotted path of their module, e.g. `pkg.sub`.
+    They hold the module data, without its sub-modules, and its statistics.
+    Returns the index of the shards, in module order, and the shards by name.
+    """
+
+    statistics = doc["statistics"]
+    names, shards = [], {}
+
+    def split(name, module):
+        data = {k: v for k, v in module.items()
+                if k not in ("modules", "statistics")}
+        names.append(name)
+        shards[name] = {
+            "module": data,
+            "package": "modules" in module,
+            "statistics": statistics.get(module.get("path", None), None)}
+        for basename, submodule in module.get("modules", {}).items():
+            split(name + "." + basename, submodule)
+
+    split(package_name, doc)
+    return {"shards": names}, shards
+
+
+def assemble_doc(index, read):
+    """Assemble the documentation of a package from its shards
+
+    The shards listed in the *index* are loaded with the *read* function,
+    given their name.
+    """
+
+    statistics = {}
+    doc = {"statistics": statistics}
+    modules = {}
+    for name in index["shards"]:
+        shard = read(name)
+        parent, _, basename = name.rpartition(".")
+        if parent:
+            module = {}
+            modules[parent]["modules"][basename] = module
+        else:
+            module = doc
+        module.update(shard["module"])
+        if shard["package"]:
+            module["modules"] = {}
+        modules[name] = module
+        if shard["statistics"] is not None:
+            statistics[module["path"]] = shard["statistics"]
+    return doc
+
+
+def load_stats(package_dir, doc=True, session=None, commit="HEAD"):
+    """Load the statistics of a package
+
+    If the documentation is sharded, its shards are loaded only if *doc* is
+    `True`. The documentation is discarded if a shard cannot be loaded,
+    e.g. if it is missing. If a git *session* is provided, the statistics
+    of the *commit* are loaded instead of the working tree ones. A
+    `FileNotFoundError` is raised if they are missing.
+    """
+
+    if session is None:
+        def read(path):
+            with open(os.path.join(package_dir, path), "r") as f:
+                return json.load(f)
+    else:
+        def read(path):
+            data = session.read_object(commit + ":" + path)
+            if data is None:
+                raise FileNotFoundError(path)
+            return json.loads(data.decode())
+
+    stats = read(PKG_FILE)
+
+    index = stats.get("doc", None)
+    if doc and is_sharded(index):
+        try:
+            stats["doc"] = assemble_doc(
+                index, lambda name: read(PKG_SHARDS + "/" + name + ".json"))
+        except (OSError, ValueError, KeyError, TypeError):
+            del stats["doc"]
+    return stats
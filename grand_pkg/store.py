@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+Store of package statistics, as a time series
+
+Copyright (C) 2018 The GRAND collaboration
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>
+"""
+
+import argparse
+import datetime
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+
+from .session import get_git_dir, run_git
+
+__all__ = ["StatsStore", "default_store", "query", "summarise"]
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS stats (
+    id INTEGER PRIMARY KEY,
+    sha TEXT,
+    parent TEXT,
+    tree TEXT,
+    time INTEGER NOT NULL,
+    origin TEXT NOT NULL,
+    duration REAL,
+    blank INTEGER,
+    comment INTEGER,
+    docstring INTEGER,
+    code INTEGER,
+    pep8 INTEGER,
+    doc_tokens INTEGER,
+    doc_errors INTEGER
+);
+CREATE INDEX IF NOT EXISTS stats_sha ON stats (sha);
+CREATE INDEX IF NOT EXISTS stats_time ON stats (time);
+"""
+"""Layout of the statistics store"""
+
+
+_GROUPS = {
+    "all": "'all'",
+    "year": "strftime('%Y', time, 'unixepoch')",
+    "month": "strftime('%Y-%m', time, 'unixepoch')",
+    "week": "strftime('%Y-W%W', time, 'unixepoch')",
+    "day": "strftime('%Y-%m-%d', time, 'unixepoch')"
+}
+"""SQL expressions for grouping records by period"""
+
+
+def summarise(stats):
+    """Summarise the statistics of a package, e.g. for time series"""
+    n_tokens, n_errors = 0, 0
+    for v in stats["doc"]["statistics"].values():
+        n_tokens += v["n_tokens"]
+        n_errors += v["n_errors"]
+    lines = {key: stats["lines"][key]
+             for key in ("blank", "comment", "docstring", "code")}
+    return {"lines": lines, "pep8": stats["pep8"]["count"],
+            "doc": {"n_tokens": n_tokens, "n_errors": n_errors}}
+
+
+class StatsStore(object):
+    """SQLite store of package statistics summaries
+
+    Each record holds the summary of a package analysis, the analysed
+    commit if known, and the duration of the analysis. Records of known
+    commits are only appended. Commits in progress are recorded by their
+    parent and by their tree, until they are bound to their SHA-1. Their
+    records are replaced, such that a single one is kept per parent, the
+    latest one.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.executescript(_SCHEMA)
+
+        # Stores created by older versions have no tree column
+        columns = [row[1] for row in
+                   self._db.execute("PRAGMA table_info(stats)")]
+        if "tree" not in columns:
+            with self._db:
+                self._db.execute("ALTER TABLE stats ADD COLUMN tree TEXT")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def close(self):
+        """Close the store"""
+        self._db.close()
+
+    def append(self, summaries, origin="hook"):
+        """Append summaries to the store, at once
+
+        The *summaries* are dictionaries as returned by `summarise`,
+        optionally with a `commit` SHA-1, a `parent` SHA-1, a `tree` SHA-1,
+        a `time` as a Unix timestamp and a `duration` in seconds. Summaries
+        without commit replace the records of the same parent that are not
+        bound to a commit yet, e.g. those of aborted commits.
+        """
+
+        def record(summary):
+            lines, doc = summary["lines"], summary["doc"]
+            return (summary.get("commit", None), summary.get("parent", None),
+                    summary.get("tree", None),
+                    summary.get("time", int(time.time())), origin,
+                    summary.get("duration", None), lines["blank"],
+                    lines["comment"], lines["docstring"], lines["code"],
+                    summary["pep8"], doc["n_tokens"], doc["n_errors"])
+
+        records = [record(summary) for summary in summaries]
+        with self._db:
+            self._db.executemany(
+                "DELETE FROM stats WHERE sha IS NULL AND parent IS ?",
+                [(r[1],) for r in records if r[0] is None])
+            self._db.executemany(
+                "INSERT INTO stats (sha, parent, tree, time, origin, "
+                "duration, blank, comment, docstring, code, pep8, "
+                "doc_tokens, doc_errors) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, "
+                "?, ?, ?, ?)", records)
+
+    def bind_commits(self, commits):
+        """Bind the records of commits in progress to their SHA-1
+
+        The *commits* are `(sha, parent, tree)` tuples, with `None` as
+        parent for root commits. Records are matched by parent and by tree.
+        """
+        with self._db:
+            self._db.executemany(
+                "UPDATE stats SET sha = ? WHERE sha IS NULL AND parent IS ? "
+                "AND tree = ?", commits)
+
+    def has_commit(self, sha):
+        """Check if a commit has been recorded, or bound"""
+        cursor = self._db.execute(
+            "SELECT 1 FROM stats WHERE sha = ? LIMIT 1", (sha,))
+        return cursor.fetchone() is not None
+
+    def aggregate(self, since=None, until=None, group="all"):
+        """Aggregate the records over a time range, by period
+
+        The range boundaries are Unix timestamps, or `None` for an open
+        range. Records are grouped by *group*, one of `all`, `year`, `month`,
+        `week` or `day`. Returns a list of dictionaries, one per period.
+        """
+
+        conditions, args = [], []
+        if since is not None:
+            conditions.append("time >= ?")
+            args.append(since)
+        if until is not None:
+            conditions.append("time < ?")
+            args.append(until)
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+
+        period = _GROUPS[group]
+        cursor = self._db.execute(
+            "SELECT {0:} AS period, COUNT(*), MIN(time), MAX(time), "
+            "MIN(code), MAX(code), AVG(code), AVG(pep8), SUM(doc_tokens), "
+            "SUM(doc_errors), AVG(duration) FROM stats{1:} GROUP BY period "
+            "ORDER BY MIN(time)".format(period, where), args)
+
+        keys = ("period", "records", "first", "last", "code_min", "code_max",
+                "code_avg", "pep8_avg", "doc_tokens", "doc_errors",
+                "duration_avg")
+        return [dict(zip(keys, row)) for row in cursor]
+
+
+def _default_path(package_dir):
+    """Get the path to the default statistics store of a package
+
+    The store is located under the git directory shared by all the worktrees
+    of the package, or under its `.git` directory if git fails.
+    """
+    git_dir = get_git_dir(package_dir, common=True)
+    if git_dir is None:
+        git_dir = os.path.join(package_dir, ".git")
+    return os.path.join(git_dir, "grand-pkg", "stats.db")
+
+
+def default_store(package_dir):
+    """Get the default statistics store of a package
+
+    The store is shared by all the worktrees of the package. `None` is
+    returned if the store is disabled, with `GRAND_PKG_STORE=0`.
+    """
+
+    if os.getenv("GRAND_PKG_STORE", "1").lower() in ("", "0", "false", "no"):
+        return None
+
+    return StatsStore(_default_path(package_dir))
+
+
+def _parse_time(value):
+    """Parse a time given as a Unix timestamp or as an ISO date"""
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    date = datetime.datetime.fromisoformat(value)
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return int(date.timestamp())
+
+
+def query(args=None):
+    """Query the statistics store of a GRAND package"""
+
+    parser = argparse.ArgumentParser(
+        description='Aggregate the recorded statistics of a GRAND package.')
+    parser.add_argument(
+        "-s", "--since", dest = "since", type = _parse_time, default = None,
+        help = "the start of the time range, as an ISO date or a timestamp")
+    parser.add_argument(
+        "-u", "--until", dest = "until", type = _parse_time, default = None,
+        help = "the end of the time range, as an ISO date or a timestamp")
+    parser.add_argument(
+        "-g", "--group", dest = "group", choices = sorted(_GROUPS.keys()),
+        default = "all", help = "the period for grouping records")
+    parser.add_argument(
+        "-j", "--json", dest = "json", action = "store_const",
+        const = True, default = False, help = "dump the result as JSON")
+    args = parser.parse_args(args)
+
+    try:
+        package_dir = run_git("rev-parse", "--show-toplevel", check=True)
+    except subprocess.CalledProcessError:
+        print("Not a GRAND package ...", file=sys.stderr)
+        sys.exit(1)
+
+    path = _default_path(package_dir)
+    if not os.path.exists(path):
+        print("No statistics recorded ...", file=sys.stderr)
+        sys.exit(1)
+
+    with StatsStore(path) as store:
+        periods = store.aggregate(args.since, args.until, args.group)
+
+    if args.json:
+        print(json.dumps(periods))
+    else:
+        header = ("period", "records", "code", "pep8", "doc", "duration")
+        print("{:<12} {:>8} {:>8} {:>8} {:>6} {:>9}".format(*header))
+        for p in periods:
+            if p["doc_tokens"]:
+                doc = "{:.0f}%".format(
+                    100. * (1. - p["doc_errors"] / p["doc_tokens"]))
+            else:
+                doc = "-"
+            if p["duration_avg"] is not None:
+                duration = "{:.2f}s".format(p["duration_avg"])
+            else:
+                duration = "-"
+            pep8 = "-" if p["pep8_avg"] is None else                          \
+                   "{:.0f}".format(p["pep8_avg"])
+            print("{:<12} {:>8} {:>8.0f} {:>8} {:>6} {:>9}".format(
+                p["period"], p["records"], p["code_avg"], pep8, doc,
+                duration))
+
+    sys.exit(0)
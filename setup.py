@@ -15,8 +15,6 @@ MICRO = 12
 #     https://pypi.org/pypi?%3Aaction=list_classifiers
 EXTRA_CLASSIFIERS = (
     "Development Status :: 4 - Beta",
-    "Programming Language :: Python :: 3.5",
-    "Programming Language :: Python :: 3.6"
 )
 
 
@@ -26,9 +24,11 @@ def main():
         __file__, (MAJOR, MINOR, MICRO), EXTRA_CLASSIFIERS,
 
         # Vanilla setuptools.setup arguments
+        python_requires = ">=3.7",
         install_requires = (
-            "astor>=0.7.1",
+            "astor>=0.7.1; python_version < '3.9'",
             "autopep8>=1.4.0",
+            "pycodestyle>=2.7.0",
             "python-editor>=1.0.4",
             "setuptools>=40.0.0",
             "wheel>=0.32.0"
@@ -36,9 +36,12 @@ def main():
         entry_points = {
             "console_scripts" : (
                 PKG_PREFIX + "config=grand_pkg.cli:config",
+                PKG_PREFIX + "daemon=grand_pkg.daemon:daemon",
+                PKG_PREFIX + "history=grand_pkg.history:history",
                 PKG_PREFIX + "init=grand_pkg.cli:init",
                 PKG_PREFIX + "update=grand_pkg.cli:update",
                 PKG_PREFIX + "pre-commit=grand_pkg.hooks:pre_commit",
+                PKG_PREFIX + "stats=grand_pkg.store:query",
                 PKG_PREFIX + "prepare-commit-msg=grand_pkg.hooks:"
                     "prepare_commit_msg",)
         },
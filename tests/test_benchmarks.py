@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the benchmarks of the git hooks
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+
+class BenchmarksTest(unittest.TestCase):
+    """Unit tests for the benchmarks script"""
+
+    @classmethod
+    def setUpClass(cls):
+        path = os.path.join(os.path.dirname(__file__), "..", "benchmarks",
+                            "bench_hooks.py")
+        cls._script = os.path.abspath(path)
+        cls._tmpdir = tempfile.mkdtemp()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls._tmpdir)
+
+    def run_script(self, *args):
+        """Run the benchmarks on a small package"""
+        p = subprocess.run((sys.executable, self._script, "-m", "2", "-f",
+                            "2", "-d", "1", "-n", "2", "-l", "100", "-r",
+                            "1") + args,
+                           stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return p.returncode, p.stderr.decode()
+
+    def test_benchmarks(self):
+        # Check the saved results
+        path = os.path.join(self._tmpdir, "results.json")
+        code, err = self.run_script("-o", path)
+        self.assertEqual(code, 0, err)
+        with open(path) as f:
+            report = json.load(f)
+        self.assertEqual(report["parameters"], {
+            "modules": 2, "functions": 2, "docstring": 1, "depth": 2,
+            "table": 100, "repeat": 1, "jobs": 1})
+        self.assertEqual(sorted(report["results"].keys()), [
+            "analyse_package", "check_style", "count_lines",
+            "count_lines/table", "gather_doc",
+            "gather_stats", "pre-commit", "pre-commit/cached",
+            "pre-commit/incremental"])
+        for result in report["results"].values():
+            self.assertEqual(len(result["runs"]), 1)
+            self.assertEqual(result["min"], result["runs"][0])
+            self.assertGreater(result["min"], 0)
+
+        # Check the comparison to a baseline
+        code, err = self.run_script("-c", path, "-t", "1000", "-o",
+                                    os.devnull)
+        self.assertEqual(code, 0, err)
+
+        for result in report["results"].values():
+            result["min"] *= 1E-06
+        baseline = os.path.join(self._tmpdir, "baseline.json")
+        with open(baseline, "w") as f:
+            json.dump(report, f)
+        code, err = self.run_script("-c", baseline, "-o", os.devnull)
+        self.assertEqual(code, 1)
+        self.assertIn("(regression)", err)
+
+        # Check that incompatible parameters are rejected
+        code, err = self.run_script("-c", path, "-m", "3", "-o", os.devnull)
+        self.assertEqual(code, 1)
+        self.assertIn("Incompatible parameters", err)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the grand_pkg.cache module
+"""
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+import grand_pkg.cache
+from grand_pkg import hooks
+from grand_pkg.cache import AnalysisCache, MemoryCache, blob_sha
+
+
+class CacheTest(unittest.TestCase):
+    """Unit tests for the cache module"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls._pwd = os.getcwd()
+        path = os.path.dirname(__file__)
+        path = os.path.join(path, "..")
+        os.chdir(path)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.chdir(cls._pwd)
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.cache = AnalysisCache(self._tmpdir.name, "0.0.0")
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def test_blob_sha(self):
+        path = os.path.join("grand_pkg", "__init__.py")
+        with open(path, "rb") as f:
+            sha = blob_sha(f.read())
+        self.assertEqual(sha, hooks.git("hash-object", path).strip())
+
+    def test_get_set(self):
+        sha = blob_sha(b"")
+        self.assertIsNone(self.cache.get(sha, "lines"))
+        self.cache.set(sha, "lines", [0, 0, 0, 0])
+        self.assertEqual(self.cache.get(sha, "lines"), [0, 0, 0, 0])
+        self.assertIsNone(self.cache.get(sha, "pep8"))
+
+        other = AnalysisCache(self._tmpdir.name, "0.0.1")
+        self.assertIsNone(other.get(sha, "lines"))
+
+    def test_prune(self):
+        sha = blob_sha(b"")
+        old = AnalysisCache(self._tmpdir.name, "0.0.1")
+        old.set(sha, "lines", [0, 0, 0, 0])
+        recent = AnalysisCache(self._tmpdir.name, "0.0.2")
+        recent.set(sha, "lines", [0, 0, 0, 0])
+        os.utime(old.path, (0, 0))
+        os.utime(self._tmpdir.name, (0, 0))
+
+        # Only the directories of other versions, unused for long, are
+        # removed
+        self.cache.prune()
+        self.assertEqual(sorted(os.listdir(self._tmpdir.name)),
+                         ["0.0.0", "0.0.2"])
+        self.assertEqual(recent.get(sha, "lines"), [0, 0, 0, 0])
+
+    def test_default(self):
+        package_dir = os.path.join(self._tmpdir.name, "package")
+        os.makedirs(package_dir)
+        hooks.git("init", "-q", package_dir)
+
+        version = grand_pkg.cache.__version__
+        grand_pkg.cache.__version__ = "0.0.0"
+        try:
+            cache = grand_pkg.cache.default_cache(package_dir)
+        finally:
+            grand_pkg.cache.__version__ = version
+
+        # Results are specific to the Python version
+        path = os.path.join(package_dir, ".git", "grand-pkg", "cache",
+                            "0.0.0-py{:}.{:}".format(*sys.version_info[:2]))
+        self.assertTrue(os.path.isdir(path))
+        self.assertTrue(os.path.samefile(cache.path, path))
+
+    def test_memory(self):
+        # The least recently used results are dropped beyond the maximum size
+        cache = MemoryCache(self.cache, max_size=30)
+        for sha in ("a", "b", "c"):
+            cache.set(sha, "lines", [0, 0, 0, 0])
+        self.assertEqual(list(cache._data), [("b", "lines"), ("c", "lines")])
+        self.assertEqual(cache.get("b", "lines"), [0, 0, 0, 0])
+        cache.set("d", "lines", [1, 1, 1, 1])
+        self.assertEqual(list(cache._data), [("b", "lines"), ("d", "lines")])
+
+        # Dropped results are still served by the backend
+        self.assertEqual(cache.get("a", "lines"), [0, 0, 0, 0])
+        self.assertEqual(list(cache._data), [("d", "lines"), ("a", "lines")])
+
+    def test_analysis(self):
+        def analyse(cache):
+            results = (hooks.count_lines("grand_pkg", cache),
+                       hooks.check_style("grand_pkg", cache),
+                       hooks.gather_doc(".", "grand_pkg", cache=cache))
+            return json.loads(json.dumps(results))
+
+        reference = analyse(None)
+        self.assertEqual(analyse(self.cache), reference)
+        self.assertEqual(analyse(self.cache), reference)
+
+        # PEP8 results depend on the pycodestyle version
+        with open(os.path.join("grand_pkg", "hooks.py"), "rb") as f:
+            sha = blob_sha(f.read())
+        self.assertIsNone(self.cache.get(sha, "pep8"))
+        self.assertEqual(self.cache.get(sha, hooks._cache_kind("pep8")),
+                         hooks.check_style_in(None, hooks.load_source(
+                             os.path.join("grand_pkg", "hooks.py"))))
+
+
+if __name__ == "__main__":
+    unittest.main()
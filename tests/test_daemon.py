@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the grand_pkg.daemon module
+"""
+
+import contextlib
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+import unittest
+
+from grand_pkg import PKG_FILE, hooks, RunContext
+from grand_pkg.cache import MemoryCache, blob_sha
+from grand_pkg.daemon import Daemon, _WatchedTree, daemon, request,         \
+                             socket_path
+
+
+class DaemonTest(unittest.TestCase):
+    """Unit tests for the daemon module"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls._pwd = os.getcwd()
+        path = os.path.dirname(__file__)
+        path = os.path.join(path, "..")
+        os.chdir(path)
+        cls._topdir = os.getcwd()
+
+        cls._tmpdir = os.path.abspath(".git/.tmp-daemon")
+        os.makedirs(cls._tmpdir)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.chdir(cls._topdir)
+        shutil.rmtree(cls._tmpdir)
+        os.chdir(cls._pwd)
+
+    def tearDown(self):
+        os.chdir(self._topdir)
+
+    def make_package(self):
+        """Create a git repository with a sample package"""
+        package_dir = os.path.join(self._tmpdir, "package")
+        sources = {
+            PKG_FILE: json.dumps({"package": {
+                "name": "pkg", "git-name": "pkg", "dist-name": "pkg"}}),
+            "docs/README.md": "# A sample package\n",
+            "pkg/__init__.py": '"""A sample package"""\nfrom .a import f\n',
+            "pkg/a.py": '"""Module a"""\n\n\ndef f(x):\n    pass\n',
+            "pkg/build/b.py": "x=1\n",
+            ".gitignore": "build/\n"}
+        for path, content in sources.items():
+            path = os.path.join(package_dir, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(content)
+
+        os.chdir(package_dir)
+        hooks.git("init", "-q")
+        hooks.git("add", ".")
+        return package_dir
+
+    def check_stats(self, package_dir):
+        """Check the statistics dumped by the daemon"""
+        with open(PKG_FILE) as f:
+            stats = json.load(f)
+        reference = hooks.gather_stats(package_dir, "pkg")
+        for key, value in json.loads(json.dumps(reference)).items():
+            self.assertEqual(stats[key], value)
+
+    def test_watched_tree(self):
+        class Watcher:
+            def __init__(self):
+                self.paths = []
+
+            def add(self, path):
+                self.paths.append(path)
+
+            def read(self):
+                return []
+
+        top = os.path.join(self._tmpdir, "watched")
+        os.makedirs(os.path.join(top, "build"))
+        os.makedirs(os.path.join(top, "sub"))
+        with open(os.path.join(self._tmpdir, ".gitignore"), "w") as f:
+            f.write("build/\n")
+        with open(os.path.join(top, "build", "x.py"), "w") as f:
+            f.write("x=1\n")
+
+        # Ignored paths are neither indexed nor watched
+        watcher = Watcher()
+        path = os.path.join(top, "module.py")
+        with open(path, "wb") as f:
+            f.write(b"x = 1\n")
+        tree = _WatchedTree(top, self._tmpdir, watcher)
+        self.assertTrue(tree.isfile(path))
+        self.assertFalse(tree.isdir(os.path.join(top, "build")))
+        self.assertEqual(sorted(watcher.paths),
+                         [self._tmpdir, top, os.path.join(top, "sub")])
+        self.assertEqual(hooks._list_sources(top, tree), [path])
+        old, = tree.read([path])
+
+        # Results are cached under the blob analysed, even if the change was
+        # not notified yet
+        with open(path, "wb") as f:
+            f.write(b"x = 1\ny = 2\n")
+        self.assertEqual(tree.get_sha(path), blob_sha(old))
+        cache = MemoryCache()
+        hooks._analyse_files([(path, "lines")], cache, tree=tree)
+        self.assertIsNone(cache.get(blob_sha(old), "lines"))
+        self.assertEqual(cache.get(blob_sha(b"x = 1\ny = 2\n"), "lines"),
+                         [0, 0, 0, 2])
+
+    def test_daemon(self):
+        package_dir = self.make_package()
+        self.assertIsNone(request("pre-commit"))
+
+        env = dict(os.environ)
+        env["PYTHONPATH"] = self._topdir
+        server = subprocess.Popen(
+            (sys.executable, "-c",
+             "from grand_pkg.daemon import daemon; daemon()", package_dir,
+             "--timeout", "60"), env=env)
+        try:
+            path = socket_path(package_dir)
+            for _ in range(100):
+                if os.path.exists(path):
+                    break
+                time.sleep(0.1)
+
+            # Process commits through the daemon
+            for content in ("", "\n\ndef g(y):\n    pass\n"):
+                with open(os.path.join("pkg", "a.py"), "a") as f:
+                    f.write(content)
+                with RunContext("pre-commit") as context:
+                    code = request("pre-commit")
+                self.assertEqual(code, 0)
+                self.check_stats(package_dir)
+
+            file_ = os.path.join(self._tmpdir, "COMMIT_MSG")
+            with open(file_, "w") as f:
+                f.write("Initial commit\n# This is a test\n")
+            with RunContext("prepare-commit-msg", file_) as context:
+                hooks.prepare_commit_msg()
+            self.assertEqual(context.code, 0)
+            with open(file_) as f:
+                self.assertIn("analysed by grand-pkg", f.read())
+
+            # Stop the daemon
+            with RunContext("grand-pkg-daemon", "--stop") as context:
+                daemon()
+            self.assertEqual(context.code, 0)
+            self.assertEqual(server.wait(timeout=10), 0)
+            self.assertFalse(os.path.exists(path))
+        finally:
+            if server.poll() is None:
+                server.kill()
+                server.wait()
+
+    def test_private_socket(self):
+        package_dir = self.make_package()
+        path = socket_path(package_dir)
+        dirname = os.path.dirname(path)
+        self.assertEqual(dirname, os.path.join(package_dir, ".git",
+                                               "grand-pkg", "daemon"))
+
+        # Serve fake replies, skipping the analysis
+        os.makedirs(dirname, exist_ok=True)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        server.listen()
+        server.settimeout(10)
+
+        def reply():
+            with contextlib.suppress(OSError):
+                connection, _ = server.accept()
+                with connection:
+                    connection.recv(65536)
+                    connection.sendall(b'{"code": 0, "out": "", "err": ""}')
+
+        thread = threading.Thread(target=reply)
+        thread.start()
+        try:
+            # Sockets in directories that others can access are not trusted
+            os.chmod(dirname, 0o755)
+            self.assertIsNone(request("pre-commit"))
+            with self.assertRaises(RuntimeError):
+                Daemon(package_dir).serve()
+
+            os.chmod(dirname, 0o700)
+            self.assertEqual(request("pre-commit"), 0)
+        finally:
+            server.close()
+            thread.join()
+            shutil.rmtree(dirname)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the grand_pkg.history module
+"""
+
+import json
+import os
+import shutil
+import unittest
+
+from grand_pkg import PKG_FILE, hooks, RunContext
+from grand_pkg.history import history
+from grand_pkg.store import default_store, summarise
+
+
+class HistoryTest(unittest.TestCase):
+    """Unit tests for the history module"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls._pwd = os.getcwd()
+        path = os.path.dirname(__file__)
+        path = os.path.join(path, "..")
+        os.chdir(path)
+        cls._topdir = os.getcwd()
+
+        cls._tmpdir = os.path.abspath(".git/.tmp-history")
+        os.makedirs(cls._tmpdir)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.chdir(cls._topdir)
+        shutil.rmtree(cls._tmpdir)
+        os.chdir(cls._pwd)
+
+    def tearDown(self):
+        os.chdir(self._topdir)
+
+    def commit(self, sources):
+        """Commit some package sources and return their summary"""
+        for path, content in sources.items():
+            path = os.path.join("pkg", path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(content)
+        hooks.git("add", ".")
+        hooks.git("commit", "-q", "-m", "update")
+        try:
+            return summarise(hooks.gather_stats(os.getcwd(), "pkg"))
+        except SyntaxError:
+            return None
+
+    def test_history(self):
+        package_dir = os.path.join(self._tmpdir, "package")
+        os.makedirs(package_dir)
+        os.chdir(package_dir)
+        hooks.git("init", "-q")
+        hooks.git("config", "user.name", "grand")
+        hooks.git("config", "user.email", "grand@example.com")
+        with open(PKG_FILE, "w") as f:
+            json.dump({"package": {"name": "pkg"}}, f)
+
+        references = [
+            self.commit({"__init__.py": '"""A package"""\nfrom .a import f\n',
+                         "a.py": "def f(x):\n    pass\n"}),
+            self.commit({"b.py": '"""Module b"""\nB = 1\n'}),
+            self.commit({"c.py": "def broken(:\n"}),
+            self.commit({"c.py": "C = 0\n"})]
+
+        output = os.path.join(self._tmpdir, "history.json")
+        for jobs in ("1", "2"):
+            with RunContext("grand-pkg-history", "-j", jobs, "-o",
+                            output) as context:
+                history()
+            self.assertEqual(context.code, 0)
+
+            with open(output) as f:
+                summaries = [json.loads(line) for line in f]
+            self.assertEqual(len(summaries), len(references))
+            for summary, reference in zip(summaries, references):
+                if reference is None:
+                    self.assertIn("error", summary)
+                else:
+                    del summary["commit"], summary["time"]
+                    self.assertEqual(summary, reference)
+
+        # Record the last commit as the pre-commit hook does
+        parent, tree = hooks.git("rev-parse", "HEAD^", "HEAD^{tree}").split()
+        summary = dict(references[-1], parent=parent, tree=tree)
+        with default_store(package_dir) as store:
+            store.append([summary])
+
+        # Record the history, only once
+        for _ in range(2):
+            with RunContext("grand-pkg-history", "--store", "-o",
+                            output) as context:
+                history()
+            self.assertEqual(context.code, 0)
+        with default_store(package_dir) as store:
+            total, = store.aggregate()
+            self.assertTrue(store.has_commit(hooks.git("rev-parse", "HEAD")))
+        self.assertEqual(total["records"], 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,11 +3,19 @@
 Unit tests for the grand_pkg.hooks module
 """
 
+import ast
+import json
 import os
 import shutil
+import subprocess
 import unittest
 
-from grand_pkg import PKG_FILE, hooks, RunContext
+from grand_pkg import PKG_FILE, PKG_SHARDS, hooks, profiler, RunContext
+from grand_pkg.cache import AnalysisCache
+from grand_pkg.session import GitSession
+from grand_pkg.source import GitTree, load_source
+from grand_pkg.stats import load_stats
+from grand_pkg.store import default_store
 
 
 class HooksTest(unittest.TestCase):
@@ -19,6 +27,7 @@ class HooksTest(unittest.TestCase):
         path = os.path.dirname(__file__)
         path = os.path.join(path, "..")
         os.chdir(path)
+        cls._topdir = os.getcwd()
 
         cls._tmpdir = ".git/.tmp"
         os.makedirs(cls._tmpdir)
@@ -28,6 +37,460 @@ class HooksTest(unittest.TestCase):
         shutil.rmtree(cls._tmpdir)
         os.chdir(cls._pwd)
 
+    def tearDown(self):
+        os.chdir(self._topdir)
+
+    def make_package(self, name):
+        """Create a git repository with a sample package"""
+        package_dir = os.path.abspath(os.path.join(self._tmpdir, name))
+        sources = {
+            "__init__.py": '"""A sample package"""\nfrom .a import *\n'
+                           "from .sub import g\n",
+            "a.py": '"""Module a"""\n__all__ = ["A", "f"]\n\n\n'
+                    "class A:\n    \"\"\"A class\"\"\"\n\n"
+                    "    def m(self, x):\n        pass\n\n\n"
+                    "def f(x, y=1):\n    \"\"\"A function\"\"\"\n",
+            "sub/__init__.py": "from .c import g\n",
+            "sub/c.py": "def g( ):\n    return 0\n"}
+        for path, content in sources.items():
+            path = os.path.join(package_dir, "pkg", path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(content)
+
+        os.chdir(package_dir)
+        hooks.git("init", "-q")
+        hooks.git("config", "user.name", "grand")
+        hooks.git("config", "user.email", "grand@example.com")
+        hooks.git("add", "pkg")
+        return package_dir
+
+    @staticmethod
+    def normalise(stats):
+        """Normalise the statistics for comparison"""
+        stats = json.loads(json.dumps(stats))
+        for outer in stats["doc"]["statistics"].values():
+            for inner in outer["tokens"].values():
+                inner[1] = sorted(inner[1])
+        return stats
+
+    def test_incremental(self):
+        package_dir = self.make_package("incremental")
+        with RunContext("analyse"):
+            stats = hooks.analyse_package(package_dir, {"package": {
+                "name": "pkg"}})
+        hooks.git("commit", "-q", "-m", "initial")
+
+        # Modify, add and delete some modules
+        with open(os.path.join("pkg", "a.py"), "a") as f:
+            f.write("\n\ndef h(z):\n    pass\n")
+        with open(os.path.join("pkg", "b.py"), "w") as f:
+            f.write('"""Module b"""\nB = 1\n"""A definition"""\n')
+        hooks.git("rm", "-q", os.path.join("pkg", "sub", "c.py"))
+        hooks.git("add", "pkg")
+
+        changes = sorted(hooks.get_staged_changes("pkg"))
+        self.assertEqual(changes, [("A", "pkg/b.py"), ("D", "pkg/sub/c.py"),
+                                   ("M", "pkg/a.py")])
+
+        with RunContext("analyse"):
+            incremental = hooks.analyse_package(
+                package_dir, json.loads(json.dumps(stats)), changes)
+            full = hooks.analyse_package(package_dir, {"package": {
+                "name": "pkg"}})
+            parallel = hooks.analyse_package(
+                package_dir, json.loads(json.dumps(stats)), changes, jobs=2)
+
+        self.assertNotEqual(incremental["lines"], stats["lines"])
+        self.assertEqual(stats["pep8"]["files"]["pkg/sub/c.py"],
+                         {"E201": 1})
+        self.assertNotIn("pkg/sub/c.py", incremental["pep8"]["files"])
+        self.assertEqual(self.normalise(incremental), self.normalise(full))
+        self.assertEqual(self.normalise(parallel), self.normalise(full))
+
+    def make_hooked_package(self, name):
+        """Create a git repository with a sample package, ready for hooks"""
+        package_dir = self.make_package(name)
+        with open(PKG_FILE, "w") as f:
+            json.dump({"package": {"name": "pkg", "git-name": "pkg",
+                                   "dist-name": "pkg"}}, f)
+        os.makedirs("docs")
+        with open(os.path.join("docs", "README.md"), "w") as f:
+            f.write("# A sample package\n")
+        hooks.git("add", ".")
+        return package_dir
+
+    def run_pre_commit(self, **settings):
+        """Run the pre-commit hook in process, without cache nor store"""
+        environ = dict(os.environ)
+        os.environ.update(GRAND_PKG_CACHE="0", GRAND_PKG_STORE="0")
+        os.environ.update(settings)
+        try:
+            with RunContext("pre-commit") as context:
+                hooks.run_pre_commit()
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+        self.assertEqual(context.code, 0)
+
+    def test_incremental_hook(self):
+        package_dir = self.make_hooked_package("incremental-hook")
+
+        pre_commit = self.run_pre_commit
+        pre_commit()
+        hooks.git("commit", "-q", "-m", "initial")
+
+        # Stage a modification, then modify the working tree further
+        path = os.path.join("pkg", "a.py")
+        with open(path, "a") as f:
+            f.write("\n\ndef h(z):\n    pass\n")
+        hooks.git("add", path)
+        with open(path, "a") as f:
+            f.write("\n\ndef k( ):\n    pass\n")
+
+        # The statistics match the staged content, whatever the number of
+        # runs, e.g. after aborted commits
+        with GitSession(package_dir) as session:
+            tree = GitTree.from_index(session, package_dir, "pkg")
+            reference = hooks.gather_stats(package_dir, "pkg", tree=tree)
+        reference = self.normalise(reference)
+        for _ in range(3):
+            pre_commit(GRAND_PKG_INCREMENTAL="1")
+            stats = self.normalise(load_stats(package_dir))
+            for key in ("lines", "pep8", "doc"):
+                self.assertEqual(stats[key], reference[key])
+
+    def test_incremental_worktree(self):
+        package_dir = self.make_hooked_package("incremental-worktree")
+
+        # Commit statistics of a working tree that differs from the index
+        path = os.path.join("pkg", "a.py")
+        with open(path) as f:
+            content = f.read()
+        with open(path, "a") as f:
+            f.write("\n\ndef k(z):\n    return z\n")
+        self.run_pre_commit()
+        hooks.git("commit", "-q", "-m", "initial")
+        stats = load_stats(package_dir)
+        self.assertEqual(stats["lines"]["files"]["pkg/a.py"], [7, 0, 3, 7])
+
+        # Stage another modification of the same file. The recorded
+        # contribution of the file is replaced, not its HEAD content
+        with open(path, "w") as f:
+            f.write(content + "\n\ndef h(z):\n    pass\n")
+        hooks.git("add", path)
+        with GitSession(package_dir) as session:
+            tree = GitTree.from_index(session, package_dir, "pkg")
+            reference = hooks.gather_stats(package_dir, "pkg", tree=tree)
+        reference = self.normalise(reference)
+        self.run_pre_commit(GRAND_PKG_INCREMENTAL="1")
+        stats = self.normalise(load_stats(package_dir))
+        for key in ("lines", "pep8", "doc"):
+            self.assertEqual(stats[key], reference[key])
+
+        # Statistics without per file line counts are analysed again
+        stats = load_stats(package_dir)
+        del stats["lines"]["files"]
+        self.assertFalse(hooks.update_package(package_dir, stats,
+                                              [("M", "pkg/a.py")]))
+
+    def test_record_stats(self):
+        package_dir = self.make_hooked_package("record-stats")
+
+        def records():
+            with default_store(package_dir) as store:
+                total, = store.aggregate()
+                return total["records"]
+
+        # Aborted commits are recorded once
+        for _ in range(2):
+            self.run_pre_commit(GRAND_PKG_STORE="1")
+        self.assertEqual(records(), 1)
+        hooks.git("commit", "-q", "-m", "initial")
+
+        # The record of the previous commit is bound to its SHA-1
+        with open(os.path.join("pkg", "b.py"), "w") as f:
+            f.write("B = 1\n")
+        hooks.git("add", "pkg")
+        self.run_pre_commit(GRAND_PKG_STORE="1")
+        self.assertEqual(records(), 2)
+        with default_store(package_dir) as store:
+            self.assertTrue(store.has_commit(hooks.git("rev-parse", "HEAD")))
+
+    def test_staged(self):
+        package_dir = self.make_package("staged")
+        with RunContext("analyse"):
+            reference = hooks.analyse_package(package_dir, {"package": {
+                "name": "pkg"}})
+
+        # Modify the working tree without staging the changes
+        with open(os.path.join("pkg", "a.py"), "a") as f:
+            f.write("\n\ndef h(z):\n    pass\n")
+        os.makedirs(os.path.join("pkg", "build"))
+        with open(os.path.join("pkg", "build", "broken.py"), "w") as f:
+            f.write("def broken(:\n")
+
+        cache = AnalysisCache(os.path.join(package_dir, "cache"), "0.0.0")
+        with GitSession(package_dir) as session:
+            tree = GitTree.from_index(session, package_dir, "pkg")
+            for _ in range(2):
+                with RunContext("analyse"):
+                    stats = hooks.analyse_package(
+                        package_dir, {"package": {"name": "pkg"}},
+                        cache=cache, tree=tree)
+                self.assertEqual(self.normalise(stats),
+                                 self.normalise(reference))
+
+    def test_doc_cache(self):
+        package_dir = self.make_package("doc-cache")
+        cache = AnalysisCache(os.path.join(package_dir, "cache"), "0.0.0")
+        reference = hooks.gather_doc(package_dir, "pkg", cache=cache)
+
+        # Modules are not gathered again once cached
+        def gather_module(*args, **kwargs):
+            raise AssertionError("module gathered again")
+
+        initial = hooks.gather_module
+        hooks.gather_module = gather_module
+        try:
+            doc = hooks.gather_doc(package_dir, "pkg", cache=cache)
+            self.assertEqual(self.normalise({"doc": doc}),
+                             self.normalise({"doc": reference}))
+
+            update = hooks.gather_doc(package_dir, "pkg", doc,
+                                      [("M", "README.md")])
+            self.assertIs(update, doc)
+        finally:
+            hooks.gather_module = initial
+
+    def test_reexports(self):
+        package_dir = self.make_package("reexports")
+        sources = {
+            "x/__init__.py": "from ..y import *\n",
+            "y/__init__.py": '__all__ = ["h"]\nfrom .e import h\n'
+                             "from ..x import k\n",
+            "y/e.py": "def h():\n    pass\n"}
+        for path, content in sources.items():
+            path = os.path.join(package_dir, "pkg", path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(content)
+
+        doc = json.loads(json.dumps(hooks.gather_doc(package_dir, "pkg")))
+        self.assertEqual(doc["functions"]["f"][3], "pkg/a.py")
+
+        # Chained re-exports refer to the defining module, whatever the
+        # order of the modules
+        self.assertEqual(doc["functions"]["g"][3], "pkg/sub/c.py")
+        x = doc["modules"]["x"]
+        self.assertEqual(x["functions"]["h"][3], "pkg/y/e.py")
+
+    def test_shards(self):
+        package_dir = self.make_package("shards")
+        with RunContext("analyse"):
+            stats = hooks.analyse_package(package_dir, {"package": {
+                "name": "pkg"}}, shards=True)
+        hooks.git("commit", "-q", "-m", "initial")
+        self.assertEqual(sorted(os.listdir(PKG_SHARDS)), [
+            "pkg.a.json", "pkg.json", "pkg.sub.c.json", "pkg.sub.json"])
+        with open(PKG_FILE) as f:
+            self.assertEqual(json.load(f)["doc"], {"shards": [
+                "pkg", "pkg.a", "pkg.sub", "pkg.sub.c"]})
+
+        # Update the shards incrementally, keeping the layout
+        hooks.git("rm", "-q", os.path.join("pkg", "sub", "c.py"))
+        changes = hooks.get_staged_changes("pkg")
+        with RunContext("analyse"):
+            incremental = hooks.analyse_package(
+                package_dir, load_stats(package_dir), changes)
+            full = hooks.analyse_package(package_dir, {"package": {
+                "name": "pkg"}})
+        self.assertEqual(self.normalise(incremental), self.normalise(full))
+        self.assertNotIn("pkg.sub.c.json", os.listdir(PKG_SHARDS))
+        self.assertEqual(self.normalise(load_stats(package_dir)),
+                         self.normalise(full))
+
+        # Merge the shards back
+        with RunContext("analyse"):
+            hooks.analyse_package(package_dir, stats, shards=False)
+        self.assertFalse(os.path.exists(PKG_SHARDS))
+        self.assertEqual(hooks.git("ls-files", PKG_SHARDS), "")
+
+    def test_profile(self):
+        package_dir = self.make_package("profile")
+        for jobs in (None, 2):
+            recorder = profiler.start()
+            try:
+                with RunContext("analyse"):
+                    stats = hooks.analyse_package(package_dir, {"package": {
+                        "name": "pkg"}}, jobs=jobs)
+            finally:
+                profiler.stop()
+
+            summary = stats["profile"]
+            self.assertEqual(summary["n_files"], 4)
+            for stage in ("gather", "gather/files", "gather/doc"):
+                self.assertIn(stage, summary["stages"])
+            for analyser in ("load", "lines", "pep8", "doc", "doc-init"):
+                self.assertIn(analyser, summary["analysers"])
+            self.assertEqual(summary["analysers"]["lines"]["count"], 4)
+            self.assertEqual(sorted(recorder.report()["files"]), [
+                os.path.join(package_dir, "pkg", path) for path in (
+                    "__init__.py", "a.py", "sub/__init__.py", "sub/c.py")])
+
+        # The summary is discarded when not profiling
+        with RunContext("analyse"):
+            hooks.analyse_package(package_dir, stats)
+        self.assertNotIn("profile", stats)
+
+    def test_profile_worktree(self):
+        package_dir = self.make_hooked_package("profile-worktree")
+        hooks.git("commit", "-q", "-m", "initial")
+        worktree = os.path.join(package_dir, "..", "profile-worktree-linked")
+        hooks.git("worktree", "add", "-q", "--detach", worktree)
+
+        # In a linked worktree, .git is a file
+        os.chdir(worktree)
+        self.assertTrue(os.path.isfile(".git"))
+        self.run_pre_commit(GRAND_PKG_PROFILE="1")
+        git_dir = os.path.join(package_dir, ".git", "worktrees",
+                               "profile-worktree-linked")
+        path = profiler.default_report(worktree, git_dir)
+        with open(path) as f:
+            self.assertIn("stages", json.load(f))
+
+    def test_compact(self):
+        package_dir = self.make_package("compact")
+        doc = hooks.gather_doc(package_dir, "pkg")
+        self.assertIsInstance(doc["modules"]["a"]["__all__"], tuple)
+
+        encoded = json.dumps(json.loads(json.dumps(doc)))
+        self.assertEqual(json.dumps(hooks._compact(json.loads(encoded))),
+                         encoded)
+
+    def test_update_file(self):
+        package_dir = self.make_package("update-file")
+        path = os.path.join(package_dir, "stats.json")
+
+        def update(content):
+            with GitSession(package_dir) as session:
+                return hooks._update_file(path, lambda f: f.write(content),
+                                          session)
+
+        def staged():
+            return hooks.git("diff", "--cached", "--name-only", "stats.json")
+
+        self.assertTrue(update("{}\n"))
+        self.assertEqual(staged(), "stats.json")
+        mtime = os.stat(path).st_mtime_ns
+
+        # Unchanged files are neither written nor staged again
+        self.assertFalse(update("{}\n"))
+        self.assertEqual(os.stat(path).st_mtime_ns, mtime)
+
+        # Files matching the disk, but not the index, are staged
+        hooks.git("reset", "-q", "stats.json")
+        self.assertTrue(update("{}\n"))
+        self.assertEqual(staged(), "stats.json")
+
+        self.assertTrue(update('{"a": 1}\n'))
+        with open(path) as f:
+            self.assertEqual(f.read(), '{"a": 1}\n')
+        self.assertEqual(sorted(os.listdir(package_dir)),
+                         [".git", "pkg", "stats.json"])
+
+    def test_count_lines(self):
+        sources = {
+            b"": (0, 0, 0, 0),
+            b'\xef\xbb\xbf# A comment\n\n"""A\r\ndocstring"""\r\nx = 1\r\n':
+                (1, 1, 2, 1),
+            b"x = 1\ry = 2\r  \r    # A comment\r\n'''A docstring'''":
+                (1, 1, 1, 2),
+            b"# -*- coding: latin-1 -*-\n\xe9 = '''\xe9\n'''\n\n":
+                (1, 1, 0, 2),
+            b's = "\'\'\'"  # Not a docstring\n\nclass A:\n'
+            b'    """A\n\n    docstring\n    """\n    # A comment\n':
+                (1, 1, 4, 2),
+            b"def broken(:\n    '''A docstring'''\n": (0, 0, 1, 1),
+            b'x = [\n    "(", \'[\',  # Brackets in strings\n\n'
+            b'    rb"""A\n)"""]\n': (1, 0, 0, 4),
+            b'rb"""A bytes docstring"""\nu\'A\' \\\n    "B"\n'
+            b'bu = f"{x}" \'\'\n': (0, 0, 3, 1),
+            b'if x:\n\ty = "A \\\nB"\n        # A comment\n'
+            b'\tz = (1 +\n  2)\n': (0, 1, 0, 5),
+            b'x = "unterminated\n': (0, 0, 0, 1),
+            b"x = 1 \\ \n": (0, 0, 0, 1)}
+        unsettled = (b"def broken", b'x = "unterminated', b"x = 1 \\ ")
+        path = os.path.join(self._tmpdir, "lines.py")
+        for data, counts in sources.items():
+            with open(path, "wb") as f:
+                f.write(data)
+            source = load_source(path, data)
+            self.assertEqual(hooks.count_lines_in(path), counts)
+            self.assertEqual(hooks._count_source_lines(source), counts)
+            self.assertIsNone(source._tokens)
+            self.assertEqual(hooks._count_rows(data), len(source.lines))
+            self.assertEqual(hooks.count_lines_in(path, source.lines),
+                             counts)
+
+            # Only the sources that the scanner does not settle are
+            # classified from their tokens
+            if data.startswith(unsettled):
+                self.assertIsNone(hooks._scan_lines(source.lines))
+            else:
+                self.assertEqual(hooks._scan_lines(source.lines), counts)
+
+        for path in hooks._list_sources("grand_pkg", None):
+            source = load_source(path)
+            counts = hooks._count_tokens(source.iter_tokens(),
+                                         lambda: len(source.lines))
+            self.assertEqual(hooks._scan_lines(source.iter_lines()), counts)
+            self.assertEqual(hooks.count_lines_in(path), counts)
+
+    def test_to_source(self):
+        if hasattr(ast, "unparse"):
+            to_source = ast.unparse
+            self.assertEqual(hooks._cache_kind("doc"), "doc-unparse")
+        else:
+            import astor
+            to_source = lambda node: astor.to_source(node)[:-1]
+            self.assertEqual(hooks._cache_kind("doc"), "doc-astor")
+
+        sources = [load_source(path).text
+                   for path in hooks._list_sources("grand_pkg")]
+        sources.append(
+            "class A(a.B, C[int, str], D(1, x=2), (E if x else F)): pass\n"
+            "def f(a, b=-1, /, c: 'C'=(1,), *d: int, e: (1)=[], f={1: 'a'}, "
+            "**g): pass\n"
+            "def g(a=u'u', b=f(*x), c={**y}, d='''A\\nB''', e='\\'\"', "
+            "f: int=1, g: (1)=-1.5): pass\n"
+            "def h(a=1, b=2, c=3, d=4, e=5, f=6, g=7, h=8, i=9, j=10, k=11, "
+            "l=12, m=13): pass\n")
+        for source in sources:
+            for node in ast.walk(ast.parse(source)):
+                if isinstance(node, ast.ClassDef):
+                    nodes = node.bases
+                elif isinstance(node, ast.FunctionDef):
+                    nodes = [node.args]
+                else:
+                    continue
+                for node in nodes:
+                    self.assertEqual(hooks._to_source(node),
+                                     to_source(node))
+
+    def test_parallel(self):
+        def analyse(jobs):
+            stats = {"package": {"name": "grand_pkg"}}
+            with RunContext("analyse"):
+                hooks.analyse_package(".", stats, jobs=jobs)
+            return json.dumps(stats)
+
+        try:
+            self.assertEqual(analyse(2), analyse(None))
+        finally:
+            hooks.git("reset", PKG_FILE)
+            hooks.git("checkout", PKG_FILE)
+
     def test_pre_commit(self):
         with RunContext("pre-commit") as context:
             hooks.pre_commit()
@@ -53,6 +516,22 @@ class HooksTest(unittest.TestCase):
             hooks.prepare_commit_msg()
         self.assertEqual(context.code, 0)
 
+    def test_commit_msg_hook(self):
+        hook = os.path.join(self._tmpdir, "prepare-commit-msg")
+        with open(hook, "w") as f:
+            f.write(hooks.make_commit_msg_hook())
+        os.chmod(hook, 0o755)
+
+        for msg in ("Initial commit\n# This is a test\n", "No comment\n"):
+            file_ = os.path.join(self._tmpdir, "COMMIT_MSG")
+            with open(file_, "w") as f:
+                f.write(msg)
+            p = subprocess.run((hook, file_), stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT)
+            self.assertEqual(p.returncode, 0, p.stdout)
+            with open(file_) as f:
+                self.assertEqual(f.read(), hooks.add_banner(msg))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Import time regression tests for the grand_pkg console scripts
+"""
+
+import os
+import re
+import subprocess
+import sys
+import unittest
+
+
+class ImportsTest(unittest.TestCase):
+    """Import time regression tests"""
+
+    budget = 0.2
+    """Import time budget of a console script, in seconds"""
+
+    heavy = ("astor", "distutils", "editor", "pycodestyle", "setuptools")
+    """Heavy modules, which must only be loaded when used"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls._topdir = os.path.abspath(os.path.join(
+            os.path.dirname(__file__), ".."))
+
+        # Get the console scripts from the setup file
+        with open(os.path.join(cls._topdir, "setup.py")) as f:
+            setup = f.read()
+        cls.scripts = re.findall(
+            r'PKG_PREFIX \+ "([\w-]+)=([\w.]+):', setup)
+
+    def import_module(self, module):
+        """Import a module in a fresh interpreter
+
+        Returns the imported modules with their cumulative import time, in
+        seconds.
+        """
+        env = dict(os.environ)
+        env["PYTHONPATH"] = self._topdir
+        p = subprocess.run((sys.executable, "-X", "importtime", "-c",
+                            "import " + module), env=env, cwd=self._topdir,
+                           stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.assertEqual(p.returncode, 0, p.stderr.decode())
+
+        modules = {}
+        for line in p.stderr.decode().splitlines():
+            fields = line.split("|")
+            if len(fields) != 3:
+                continue
+            try:
+                cumulative = int(fields[1])
+            except ValueError:
+                # This is the header line
+                continue
+            modules[fields[2].strip()] = cumulative * 1E-06
+        return modules
+
+    def test_scripts(self):
+        self.assertGreater(len(self.scripts), 0)
+        for script, module in self.scripts:
+            modules = self.import_module(module)
+            for name in modules.keys():
+                for heavy in self.heavy:
+                    self.assertFalse(
+                        (name == heavy) or name.startswith(heavy + "."),
+                        "{:} imports {:}".format(script, name))
+            self.assertLess(modules[module], self.budget,
+                            "{:} is too slow to import".format(script))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the grand_pkg.profiler module
+"""
+
+import tracemalloc
+import unittest
+
+from grand_pkg import profiler
+
+
+class ProfilerTest(unittest.TestCase):
+    """Unit tests for the profiler module"""
+
+    def tearDown(self):
+        profiler.stop()
+
+    def test_stages(self):
+        recorder = profiler.start()
+        self.assertIs(profiler.start(), recorder)
+        self.assertIs(profiler.get_profiler(), recorder)
+
+        with recorder.stage("outer"):
+            for _ in range(2):
+                with recorder.stage("inner"):
+                    data = bytearray(1 << 20)
+                    del data
+        stages = recorder.stages
+        self.assertEqual(sorted(stages.keys()), ["outer", "outer/inner"])
+        self.assertEqual(stages["outer/inner"]["count"], 2)
+        self.assertGreater(stages["outer/inner"]["memory"], 1000000)
+        self.assertGreaterEqual(stages["outer"]["memory"],
+                                stages["outer/inner"]["memory"])
+        self.assertGreaterEqual(stages["outer"]["wall"],
+                                stages["outer/inner"]["wall"])
+
+        recorder.add_file("a.py", {"lines": {"wall": 1., "cpu": 1.,
+                                             "memory": 2}})
+        recorder.add_file("b.py", {"lines": {"wall": 2., "cpu": 1.,
+                                             "memory": 1}})
+        summary = recorder.summary()
+        self.assertEqual(summary["n_files"], 2)
+        self.assertEqual(summary["analysers"]["lines"], {
+            "wall": 3., "cpu": 2., "memory": 2, "count": 2})
+        self.assertIn("a.py", recorder.report()["files"])
+
+        self.assertIs(profiler.stop(), recorder)
+        self.assertIsNone(profiler.get_profiler())
+        self.assertFalse(tracemalloc.is_tracing())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the grand_pkg.session module
+"""
+
+import os
+import unittest
+
+from grand_pkg.session import GitSession, run_git
+
+
+class SessionTest(unittest.TestCase):
+    """Unit tests for the session module"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls._pwd = os.getcwd()
+        path = os.path.dirname(__file__)
+        path = os.path.join(path, "..")
+        os.chdir(path)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.chdir(cls._pwd)
+
+    def test_run(self):
+        top = run_git("rev-parse", "--show-toplevel")
+        self.assertEqual(top, os.getcwd())
+        self.assertTrue(run_git("rev-parse", "--verify", "no-such-ref"))
+
+        with GitSession() as session:
+            self.assertEqual(session.run("rev-parse", "--show-toplevel"), top)
+            with self.assertRaises(Exception):
+                session.run("rev-parse", "--verify", "no-such-ref")
+
+    def test_read_objects(self):
+        paths = ("setup.py", "LICENSE", "grand_pkg/__init__.py")
+        with GitSession() as session:
+            contents = session.read_objects(
+                ["HEAD:" + path for path in paths] + ["HEAD:no-such-file"])
+            self.assertIsNone(contents.pop())
+            for path, content in zip(paths, contents):
+                self.assertEqual(content, session.read_object("HEAD:" + path))
+                self.assertEqual(content.decode(),
+                                 run_git("show", "HEAD:" + path) + "\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
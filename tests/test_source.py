@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the grand_pkg.source module
+"""
+
+import ast
+import os
+import tempfile
+import unittest
+
+from grand_pkg import hooks
+from grand_pkg.source import GitTree, ScanTree, Source, load_source
+
+
+class SourceTest(unittest.TestCase):
+    """Unit tests for the source module"""
+
+    def test_source(self):
+        data = "# -*- coding: latin-1 -*-\nx = 'é'\n".encode("latin-1")
+        source = Source("test.py", data)
+        self.assertEqual(source.lines[1], "x = 'é'\n")
+        self.assertIs(source.lines, source.lines)
+        self.assertIsInstance(source.tree, ast.Module)
+        self.assertIs(source.tree, source.tree)
+        self.assertEqual(source.tokens[-1].type, hooks.tokenize.ENDMARKER)
+        self.assertIsNone(source.token_error)
+
+    def test_iter_tokens(self):
+        data = "# -*- coding: latin-1 -*-\r\nx = 'é'\r".encode("latin-1")
+        source = Source("test.py", data)
+        tokens = list(source.iter_tokens())
+        self.assertIsNone(source._tokens)
+        self.assertEqual(tokens, source.tokens)
+        self.assertEqual(list(source.iter_tokens()), source.tokens)
+
+        # Tokenize errors are raised at the end of the stream, whether the
+        # tokens are kept or not
+        source = Source("test.py", b"x = (\n")
+        for _ in range(2):
+            with self.assertRaises(hooks.tokenize.TokenError):
+                list(source.iter_tokens())
+            source.token_error
+
+    def test_invalid(self):
+        source = Source("test.py", b"x = (\n")
+        self.assertIsNotNone(source.token_error)
+        result = hooks.check_style_in(source.path, source)
+        self.assertIn("E901", result)
+
+    def test_analysers(self):
+        path = os.path.join(os.path.dirname(__file__), "..", "grand_pkg",
+                            "hooks.py")
+        source = load_source(path)
+        self.assertEqual(hooks.count_lines_in(path),
+                         hooks.count_lines_in(path, source.lines))
+        self.assertEqual(hooks.check_style_in(path),
+                         hooks.check_style_in(path, source))
+
+    def test_index_tree(self):
+        tree = GitTree("top", (("pkg/__init__.py", "1"), ("pkg/a.py", "2"),
+                                 ("pkg/sub/b.py", "3")), None)
+        walk = [(root, sorted(dirs), sorted(files))
+                for root, dirs, files in tree.walk("top/pkg")]
+        self.assertEqual(walk, [("top/pkg", ["sub"], ["__init__.py", "a.py"]),
+                                ("top/pkg/sub", [], ["b.py"])])
+        self.assertTrue(tree.isdir("top/pkg/sub"))
+        self.assertTrue(tree.isfile("top/pkg/a.py"))
+        self.assertFalse(tree.isfile("top/pkg/sub"))
+        self.assertEqual(tree.get_sha("top/pkg/sub/b.py"), "3")
+
+        roots = []
+        for root, dirs, files in tree.walk("top"):
+            roots.append(root)
+            dirs.remove("pkg")
+        self.assertEqual(roots, ["top"])
+        self.assertEqual(list(tree.walk("top/missing")), [])
+
+    def test_scan_tree(self):
+        files = {
+            ".gitignore": "# Ignored paths\n/pkg/*.tmp\nvenv/\n",
+            "pkg/.gitignore": "build/\n*.log\n!keep.log\n",
+            "pkg/__init__.py": "", "pkg/a.tmp": "", "pkg/a.log": "",
+            "pkg/keep.log": "", "pkg/build/b.py": "", "pkg/sub/build": "",
+            "pkg/sub/c.py": "", "pkg/sub/venv/d.py": "",
+            "pkg/sub/e.tmp": ""}
+        with tempfile.TemporaryDirectory() as top:
+            for path, content in files.items():
+                path = os.path.join(top, path)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "w") as f:
+                    f.write(content)
+
+            pkg = os.path.join(top, "pkg")
+            tree = ScanTree(pkg, top)
+            walk = [(os.path.relpath(root, top), sorted(dirs), sorted(files))
+                    for root, dirs, files in tree.walk(pkg)]
+            self.assertEqual(walk, [
+                ("pkg", ["sub"], [".gitignore", "__init__.py", "keep.log"]),
+                ("pkg/sub", [], ["build", "c.py", "e.tmp"])])
+            self.assertTrue(tree.isfile(os.path.join(pkg, "sub", "c.py")))
+            self.assertFalse(tree.isdir(os.path.join(pkg, "build")))
+            self.assertIsNone(tree.get_sha(os.path.join(pkg, "__init__.py")))
+
+            # Without a root, only the scanned directories are considered
+            tree = ScanTree(pkg)
+            self.assertTrue(tree.isfile(os.path.join(pkg, "a.tmp")))
+            self.assertTrue(tree.isdir(os.path.join(pkg, "sub", "venv")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the grand_pkg.stats module
+"""
+
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from grand_pkg import PKG_FILE, PKG_SHARDS, hooks
+from grand_pkg.session import GitSession
+from grand_pkg.stats import (assemble_doc, dump_json, is_sharded,
+                             load_stats, split_doc)
+
+
+class StatsTest(unittest.TestCase):
+    """Unit tests for the stats module"""
+
+    @classmethod
+    def setUpClass(cls):
+        path = os.path.join(os.path.dirname(__file__), "..")
+        doc = hooks.gather_doc(path, "grand_pkg")
+        cls.doc = json.loads(json.dumps(doc))
+
+    def test_dump(self):
+        stats = {"doc": self.doc, "lines": {"code": 1, "blank": 2},
+                 "imports": {2: {"": [["a", "b"]]}, 10: {}}, "empty": {}}
+
+        def dump(stats):
+            f = io.StringIO()
+            dump_json(stats, f)
+            return f.getvalue()
+
+        # The output is canonical and line oriented
+        text = dump(stats)
+        self.assertEqual(json.loads(text), json.loads(json.dumps(stats)))
+        self.assertEqual(dump(json.loads(text)), text)
+        self.assertTrue(text.startswith('{\n "doc": {\n'))
+        self.assertIn('\n "empty": {},\n "imports": {\n  "10": {},\n'
+                      '  "2": {\n   "": [["a", "b"]]\n  }\n },\n'
+                      ' "lines": {\n  "blank": 2,\n  "code": 1\n }\n}\n',
+                      text)
+
+    def test_split(self):
+        index, shards = split_doc(self.doc, "grand_pkg")
+        self.assertTrue(is_sharded(index))
+        self.assertFalse(is_sharded(self.doc))
+        self.assertEqual(index["shards"][0], "grand_pkg")
+        self.assertIn("grand_pkg.hooks", shards)
+        self.assertNotIn("modules", shards["grand_pkg"]["module"])
+
+        doc = assemble_doc(index, lambda name: shards[name])
+        self.assertEqual(json.dumps(doc), json.dumps(self.doc))
+
+    def test_load(self):
+        index, shards = split_doc(self.doc, "grand_pkg")
+        stats = {"package": {"name": "grand_pkg"}, "doc": index}
+        with tempfile.TemporaryDirectory() as package_dir:
+            with open(os.path.join(package_dir, PKG_FILE), "w") as f:
+                json.dump(stats, f)
+            os.mkdir(os.path.join(package_dir, PKG_SHARDS))
+            for name, shard in shards.items():
+                path = os.path.join(package_dir, PKG_SHARDS, name + ".json")
+                with open(path, "w") as f:
+                    json.dump(shard, f)
+
+            self.assertEqual(load_stats(package_dir, doc=False), stats)
+            loaded = load_stats(package_dir)
+            self.assertEqual(json.dumps(loaded["doc"]), json.dumps(self.doc))
+
+            # The committed statistics can be loaded instead
+            with GitSession(package_dir) as session:
+                session.run("init", "-q")
+                self.assertRaises(FileNotFoundError, load_stats,
+                                  package_dir, session=session)
+                session.run("add", ".")
+                session.run("-c", "user.name=grand", "-c",
+                            "user.email=grand@example.com", "commit", "-q",
+                            "-m", "initial")
+
+            # The documentation is discarded if a shard is missing
+            os.remove(os.path.join(package_dir, PKG_SHARDS,
+                                   "grand_pkg.hooks.json"))
+            self.assertNotIn("doc", load_stats(package_dir))
+            with GitSession(package_dir) as session:
+                loaded = load_stats(package_dir, session=session)
+            self.assertEqual(json.dumps(loaded["doc"]), json.dumps(self.doc))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for the grand_pkg.store module
+"""
+
+import json
+import os
+import tempfile
+import unittest
+
+from grand_pkg import hooks, RunContext
+from grand_pkg.store import StatsStore, default_store, query
+
+
+class StoreTest(unittest.TestCase):
+    """Unit tests for the store module"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls._pwd = os.getcwd()
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        os.chdir(self._pwd)
+        self._tmpdir.cleanup()
+
+    @staticmethod
+    def summary(code, time, commit=None):
+        return {"lines": {"blank": 1, "comment": 2, "docstring": 3,
+                          "code": code}, "pep8": code // 10,
+                "doc": {"n_tokens": 4, "n_errors": 1}, "time": time,
+                "commit": commit}
+
+    def test_aggregate(self):
+        path = os.path.join(self._tmpdir.name, "stats.db")
+        day = 24 * 3600
+        with StatsStore(path) as store:
+            store.append([self.summary(100 * (i + 1), i * day, str(i))
+                          for i in range(10)], origin="history")
+            self.assertTrue(store.has_commit("3"))
+            self.assertFalse(store.has_commit("10"))
+
+            total, = store.aggregate()
+            self.assertEqual(total["records"], 10)
+            self.assertEqual(total["code_min"], 100)
+            self.assertEqual(total["code_max"], 1000)
+            self.assertEqual(total["doc_tokens"], 40)
+
+            periods = store.aggregate(since=2 * day, until=5 * day,
+                                      group="day")
+            self.assertEqual([p["period"] for p in periods],
+                             ["1970-01-03", "1970-01-04", "1970-01-05"])
+            self.assertEqual([p["code_avg"] for p in periods],
+                             [300, 400, 500])
+
+        # Records are appended to an existing store
+        with StatsStore(path) as store:
+            store.append([self.summary(0, 10 * day)])
+            total, = store.aggregate()
+            self.assertEqual(total["records"], 11)
+
+    def test_pending(self):
+        path = os.path.join(self._tmpdir.name, "stats.db")
+        with StatsStore(path) as store:
+            # Commits in progress are recorded once per parent
+            for code in (100, 200):
+                summary = self.summary(code, 0)
+                summary.update(parent="p", tree="t" + str(code))
+                store.append([summary])
+            total, = store.aggregate()
+            self.assertEqual(total["records"], 1)
+            self.assertEqual(total["code_max"], 200)
+
+            # Records are bound to their commit by parent and by tree
+            store.bind_commits([("c", "p", "t100")])
+            self.assertFalse(store.has_commit("c"))
+            store.bind_commits([("c", "p", "t200")])
+            self.assertTrue(store.has_commit("c"))
+
+            summary = self.summary(300, 0)
+            summary["parent"] = "p"
+            store.append([summary])
+            total, = store.aggregate()
+            self.assertEqual(total["records"], 2)
+
+    def test_query(self):
+        package_dir = self._tmpdir.name
+        os.chdir(package_dir)
+        hooks.git("init", "-q")
+        with default_store(package_dir) as store:
+            store.append([self.summary(100, 0), self.summary(300, 3600)])
+
+        with RunContext("grand-pkg-stats", "--json", "--since",
+                        "1970-01-01T00:30") as context:
+            query()
+        self.assertEqual(context.code, 0)
+        periods = json.loads(context.out)
+        self.assertEqual(len(periods), 1)
+        self.assertEqual(periods[0]["code_avg"], 300)
+
+        with RunContext("grand-pkg-stats", "--group", "month") as context:
+            query()
+        self.assertEqual(context.code, 0)
+        self.assertIn("1970-01", context.out)
+
+    def test_worktree(self):
+        package_dir = os.path.join(self._tmpdir.name, "package")
+        os.makedirs(package_dir)
+        os.chdir(package_dir)
+        hooks.git("init", "-q")
+        hooks.git("config", "user.name", "grand")
+        hooks.git("config", "user.email", "grand@example.com")
+        hooks.git("commit", "-q", "--allow-empty", "-m", "initial")
+        worktree = os.path.join(self._tmpdir.name, "worktree")
+        hooks.git("worktree", "add", "-q", "--detach", worktree)
+
+        # In a linked worktree, .git is a file. The store of the main
+        # worktree is shared
+        os.chdir(worktree)
+        self.assertTrue(os.path.isfile(".git"))
+        with default_store(worktree) as store:
+            store.append([self.summary(100, 0)])
+        self.assertTrue(os.path.exists(os.path.join(
+            package_dir, ".git", "grand-pkg", "stats.db")))
+
+        with RunContext("grand-pkg-stats", "--json") as context:
+            query()
+        self.assertEqual(context.code, 0)
+        self.assertEqual(json.loads(context.out)[0]["records"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()